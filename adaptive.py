@@ -0,0 +1,182 @@
+"""
+Adaptive evaluation: stratified random draws with online estimates, stopping once the confidence interval is narrow enough
+"""
+
+import os
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import zeroshot
+from evaluate import STRATEGIES, output_path
+from journal import is_error, write_results_csv
+from manifest import parse_filename
+from results_store import read_decisions, read_meta_columns
+from runner import build_arg_parser, parse_args, run_strategies_with_args
+from verdict import parse_decision
+
+ADAPTIVE_DIR = "adaptive"
+DEFAULT_BATCH = 100
+DEFAULT_WIDTH = 0.05       # full width of the confidence interval to stop at
+MIN_PER_STRATUM = 2        # images drawn from every stratum (or all of them) before stopping
+PRIOR_VARIANCE = 0.25      # one pseudo-observation at a coin flip's variance per stratum
+
+def stratum_of(filename):
+    """Return the stratum of a CASIA image: its category if authentic, its source-destination pair if spliced."""
+    truth, category, _, src, dst = parse_filename(filename)
+    if truth == 'authentic':
+        return f"Au:{category}"
+    if truth == 'spliced':
+        return f"Sp:{src}-{dst}"
+    return "other"
+
+def stratified_order(image_paths, seed=0):
+    """Return the images in a random order that covers every stratum first, then stays close to proportional.
+
+    The first `MIN_PER_STRATUM` images of each shuffled stratum come first, so
+    even the smallest strata are covered after a few dozen draws. The rest of
+    each stratum is spread evenly over [0, 1) with a random offset, and sorting by
+    those positions interleaves the strata.
+    """
+    rng = np.random.default_rng(seed)
+    strata = pd.Series([stratum_of(os.path.basename(path)) for path in image_paths])
+    positions = np.empty(len(image_paths))
+    head = np.zeros(len(image_paths), dtype=bool)
+    for _, rows in strata.groupby(strata).groups.items():
+        rows = rng.permutation(np.asarray(rows))
+        head[rows[:MIN_PER_STRATUM]] = True
+        rest = rows[MIN_PER_STRATUM:]
+        positions[rows[:MIN_PER_STRATUM]] = rng.random(min(MIN_PER_STRATUM, len(rows)))
+        positions[rest] = (np.arange(len(rest)) + rng.random()) / max(len(rest), 1)
+    return [image_paths[i] for i in np.lexsort((rng.random(len(image_paths)), positions, ~head))]
+
+def stratified_estimate(values, strata, sizes, level=0.95):
+    """Return (estimate, half width) of a population mean from per-stratum samples.
+
+    `values` are the observations (NaN for missing answers), `strata` their
+    stratum and `sizes` the population size of every stratum. Each stratum is
+    weighted by its share of the population, and the variance carries the finite
+    population correction.
+    """
+    frame = pd.DataFrame({"value": values, "stratum": strata}).dropna()
+    grouped = frame.groupby("stratum")["value"]
+    n = grouped.size()
+    mean = grouped.mean()
+    squares = grouped.apply(lambda x: ((x - x.mean()) ** 2).sum())
+    weight = sizes.loc[n.index] / sizes.sum()
+    variance = ((squares + PRIOR_VARIANCE) / n) / n * (1 - n / sizes.loc[n.index])
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    # Strata without answers yet are left out of the estimate but count against the stopping rule
+    return float((weight * mean).sum() / weight.sum()), float(z * np.sqrt((weight ** 2 * variance).sum()))
+
+def correctness(decisions, filenames):
+    """Return 1/0 per image for whether its decision is right, NaN when missing, failed or unparseable."""
+    values = []
+    for filename in filenames:
+        decision = decisions.get(filename)
+        label = None if decision is None or is_error(decision) else parse_decision(decision)
+        values.append(np.nan if label is None else float(label == parse_filename(filename)[0]))
+    return np.array(values)
+
+def collect_rows(output_csv, rows):
+    """Add the decisions, scores and extra columns of a results CSV to those kept in `rows` for it."""
+    decisions, scores, columns = rows[output_csv]
+    for filename, decision, score, _ in read_decisions(output_csv):
+        decisions[filename] = decision
+        if np.isnan(score):
+            scores.pop(filename, None)
+        else:
+            scores[filename] = score
+    for name, values in read_meta_columns(output_csv).items():
+        columns.setdefault(name, {}).update(values)
+
+def main():
+    parser = build_arg_parser(__doc__, None, None)
+    parser.add_argument("--folders", nargs="+", default=["CASIA2/Au_sample", "CASIA2/Sp_sample"],
+                        help="Folders evaluated together as one population")
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=["zero_shot"],
+                        help="One strategy to estimate, or two to estimate the difference between")
+    parser.add_argument("--width", type=float, default=DEFAULT_WIDTH,
+                        help="Stop once the confidence interval (of the difference, for two strategies) is this wide")
+    parser.add_argument("--until-separated", action="store_true",
+                        help="With two strategies, also stop once the interval of their difference excludes 0")
+    parser.add_argument("--level", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH, help="Images drawn between checks")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the stratified draw order")
+    parser.add_argument("--output-dir", default="results",
+                        help="Results folder; the partial runs go to its adaptive/ subfolder")
+    args = parse_args(parser)
+    if len(args.strategies) > 2:
+        parser.error("--strategies takes one strategy, or two to compare")
+    if args.retry_errors or args.batch or args.shard:
+        parser.error("the adaptive evaluation cannot run with --retry-errors, --batch or --shard")
+
+    folder_of = {path: folder for folder in args.folders for path in zeroshot.get_all_image_paths(folder)}
+    image_paths = list(folder_of)
+    order = stratified_order(image_paths, args.seed)
+    strata = np.array([stratum_of(os.path.basename(path)) for path in order])
+    sizes = pd.Series(strata).value_counts()
+    builders = {strategy: STRATEGIES[strategy]() for strategy in args.strategies}
+
+    def outputs(folder, strategy):
+        # Partial runs get their own strategy name, so the results store keeps them apart from full runs
+        return os.path.join(args.output_dir, ADAPTIVE_DIR,
+                            os.path.basename(output_path(args.output_dir, folder, f"{ADAPTIVE_DIR}_{strategy}")))
+
+    # Each runner call rewrites its CSVs with its own batch, so the rows of every batch are kept here
+    rows = {outputs(folder, strategy): ({}, {}, {}) for folder in args.folders for strategy in args.strategies}
+    drawn = 0
+    while drawn < len(order):
+        batch = order[drawn:drawn + args.batch_size]
+        drawn += len(batch)
+        for folder in args.folders:
+            folder_batch = [path for path in batch if folder_of[path] == folder]
+            if folder_batch:
+                run_strategies_with_args(folder_batch, {outputs(folder, strategy): builder
+                                                        for strategy, builder in builders.items()}, args)
+                for strategy in args.strategies:
+                    collect_rows(outputs(folder, strategy), rows)
+        args.fresh = False  # only the first batch starts the journals afresh
+
+        filenames = [os.path.basename(path) for path in order[:drawn]]
+        # The CSV rows rather than the journals, so images the forensic pre-filter decided count too
+        correct = {strategy: correctness({filename: decision for folder in args.folders
+                                          for filename, decision in rows[outputs(folder, strategy)][0].items()},
+                                         filenames)
+                   for strategy in args.strategies}
+        estimates = {strategy: stratified_estimate(values, strata[:drawn], sizes, args.level)
+                     for strategy, values in correct.items()}
+        line = ", ".join(f"{strategy} {estimate:.3f} ± {half:.3f}" for strategy, (estimate, half) in estimates.items())
+        if len(args.strategies) == 2:
+            difference, half = stratified_estimate(correct[args.strategies[0]] - correct[args.strategies[1]],
+                                                   strata[:drawn], sizes, args.level)
+            line += f", difference {difference:+.3f} ± {half:.3f}"
+        else:
+            half = estimates[args.strategies[0]][1]
+        print(f"\n{drawn} of {len(order)} images drawn: {line}")
+
+        per_stratum = pd.Series(strata[:drawn]).value_counts().reindex(sizes.index, fill_value=0)
+        covered = (per_stratum >= np.minimum(MIN_PER_STRATUM, sizes)).all()
+        separated = args.until_separated and len(args.strategies) == 2 and abs(difference) > half
+        if covered and (2 * half <= args.width or separated):
+            break
+
+    # Rebuild the CSVs over every drawn image, with the columns the runner added to each batch
+    for folder in args.folders:
+        folder_names = [os.path.basename(path) for path in order[:drawn] if folder_of[path] == folder]
+        for strategy in args.strategies:
+            output_csv = outputs(folder, strategy)
+            decisions, scores, columns = rows[output_csv]
+            write_results_csv(output_csv, decisions, sorted(folder_names), scores, columns or None)
+
+    avoided = (len(order) - drawn) * len(args.strategies)
+    print(f"\nStopped after {drawn} of {len(order)} images; {avoided} of {len(order) * len(args.strategies)} "
+          f"calls avoided ({avoided / (len(order) * len(args.strategies)):.1%})")
+    by_stratum = pd.DataFrame({"images": sizes, "drawn": pd.Series(strata[:drawn]).value_counts()}).fillna(0)
+    for strategy, values in correct.items():
+        by_stratum[f"{strategy}_accuracy"] = pd.Series(values).groupby(strata[:drawn]).mean()
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200,
+                           'display.precision', 3):
+        print(by_stratum.sort_index())
+
+if __name__ == "__main__":
+    main()
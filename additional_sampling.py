@@ -3,23 +3,53 @@ Sample additional images for future use in the prompts
 """
 
 import os
-import shutil
 import random
 import re
 from collections import defaultdict
+from manifest import DEFAULT_MANIFEST_PATH, load_subset, materialize_view, open_manifest, pool_name, save_subset
 
 categories = ['ani', 'arc', 'cha']
 
+def load_pool(conn, input_dir, output_dir):
+    """Return the source folder and filenames of the full sample recorded for `input_dir` in the manifest.
+
+    The pool is the sample as `sampling.py` drew it, before any examples were
+    carved out, so every run draws from the same images. A manifest without a
+    recorded pool gets one from the sample plus the examples already carved out.
+    """
+    name = os.path.basename(input_dir)
+    source_dir, filenames = load_subset(conn, pool_name(name))
+    if source_dir is None:
+        source_dir, filenames = load_subset(conn, name)
+        if source_dir is None:
+            raise ValueError(f"No subset recorded for {input_dir}; run sampling.py first to build the manifest view.")
+        carved_dir, carved = load_subset(conn, os.path.basename(output_dir))
+        filenames = sorted(set(filenames) | set(carved if carved_dir == source_dir else []))
+        save_subset(conn, pool_name(name), source_dir, filenames)
+    return source_dir, filenames
+
+def carve_subset(conn, source_dir, pool, selected_files, input_dir, output_dir, mode='symlink'):
+    """Record the selected files as their own subset and the rest of the pool as the sample, and refresh both views."""
+    selected = set(selected_files)
+    remaining = [filename for filename in pool if filename not in selected]
+    save_subset(conn, os.path.basename(output_dir), source_dir, sorted(selected))
+    save_subset(conn, os.path.basename(input_dir), source_dir, remaining)
+    materialize_view(source_dir, sorted(selected), output_dir, mode)
+    materialize_view(source_dir, remaining, input_dir, mode)
+
 def sample_authentic_for_prompt(
-        input_dir = "CASIA2/Au_sample", output_dir = "CASIA2/Au_additional", total_samples = 38):
+        input_dir = "CASIA2/Au_sample", output_dir = "CASIA2/Au_additional", total_samples = 38,
+        manifest_path = DEFAULT_MANIFEST_PATH, seed = 0):
 
-    os.makedirs(output_dir, exist_ok=True)
+    conn = open_manifest(manifest_path)
+    source_dir, pool = load_pool(conn, input_dir, output_dir)
+    rng = random.Random(seed)
 
     # Group files by category
     category_files = defaultdict(list)
     pattern = re.compile(r"^Au_(\w+)_\d+\.(jpg|jpeg|png)$", re.IGNORECASE)
 
-    for filename in os.listdir(input_dir):
+    for filename in pool:
         match = pattern.match(filename)
         if match:
             category = match.group(1).lower()
@@ -40,28 +70,29 @@ def sample_authentic_for_prompt(
         files = category_files[cat]
         if len(files) < samples_per_category[cat]:
             raise ValueError(f"Not enough files in category '{cat}' to sample {samples_per_category[cat]}")
-        selected = random.sample(files, samples_per_category[cat])
+        selected = rng.sample(files, samples_per_category[cat])
         selected_files.extend(selected)
 
-    # Move selected files to new directory
-    for filename in selected_files:
-        src_path = os.path.join(input_dir, filename)
-        dst_path = os.path.join(output_dir, filename)
-        shutil.move(src_path, dst_path)
+    # Carve the selected files out of the sample view instead of moving them
+    carve_subset(conn, source_dir, pool, selected_files, input_dir, output_dir)
+    conn.close()
 
-    print(f"Moved {len(selected_files)} images to {output_dir}")
+    print(f"Linked {len(selected_files)} images to {output_dir}")
 
 
 def sample_spliced_for_prompt(
-    input_dir = "CASIA2/Sp_sample", output_dir = "CASIA2/Sp_additional", total_samples = 50):
-    os.makedirs(output_dir, exist_ok=True)
+    input_dir = "CASIA2/Sp_sample", output_dir = "CASIA2/Sp_additional", total_samples = 50,
+    manifest_path = DEFAULT_MANIFEST_PATH, seed = 0):
+    conn = open_manifest(manifest_path)
+    source_dir, pool = load_pool(conn, input_dir, output_dir)
+    rng = random.Random(seed)
 
     # Regex to extract source and destination categories
     pattern = re.compile(r"^Tp_D_[^_]+_[^_]+_[^_]+_([a-zA-Z]+)\d+_([a-zA-Z]+)\d+_\d+\.(jpg|jpeg|png)$", re.IGNORECASE)
 
     # Group files by category pair (src, dst)
     combo_bins = defaultdict(list)
-    for filename in os.listdir(input_dir):
+    for filename in pool:
         match = pattern.match(filename)
         if match:
             src_cat = match.group(1).lower()
@@ -87,14 +118,14 @@ def sample_spliced_for_prompt(
         files = combo_bins.get(pair, [])
         need = allocation[pair]
         if len(files) >= need:
-            sampled = random.sample(files, need)
+            sampled = rng.sample(files, need)
         else:
             sampled = files  # take all available
             deficit += need - len(files)
         selected_files.extend(sampled)
 
         # Track leftover files from bins with extra
-        remaining = list(set(files) - set(sampled))
+        remaining = [f for f in files if f not in sampled]
         if remaining:
             excess_pool.extend(remaining)
 
@@ -103,16 +134,14 @@ def sample_spliced_for_prompt(
         if len(excess_pool) < deficit:
             raise ValueError(
                 f"Unable to meet total sample requirement. Deficit of {deficit} but only {len(excess_pool)} extras available.")
-        supplement = random.sample(excess_pool, deficit)
+        supplement = rng.sample(excess_pool, deficit)
         selected_files.extend(supplement)
 
-    # Move selected files
-    for filename in selected_files:
-        src = os.path.join(input_dir, filename)
-        dst = os.path.join(output_dir, filename)
-        shutil.move(src, dst)
+    # Carve the selected files out of the sample view instead of moving them
+    carve_subset(conn, source_dir, pool, selected_files, input_dir, output_dir)
+    conn.close()
 
-    print(f"Moved {len(selected_files)} spliced images to {output_dir}")
+    print(f"Linked {len(selected_files)} spliced images to {output_dir}")
 
 
 def main():
@@ -0,0 +1,179 @@
+"""
+Bootstrap confidence intervals and run-to-run agreement over repeated runs
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from metrics import category_memberships, load_results, pair_runs
+
+DEFAULT_REPLICATES = 10_000
+BLOCK_SIZE = 1_000  # replicates resampled at once, bounding the index matrix in memory
+
+def label_matrix(df):
+    """Align runs by filename: return the per-image frame, the run names and two (images, runs) matrices.
+
+    A run is a (strategy, run) pair spanning both splits, paired as in `metrics.pair_runs`.
+    The labels are 1 for spliced, 0 authentic and -1 an invalid answer. The origins
+    number the (split, strategy, run) each answer was read from, so answers a run
+    borrowed from the other split's base run can be told apart from its own.
+    Only images decided in every run are kept.
+    """
+    df = df.assign(origin=df['split'] + ':' + df['strategy'] + ':' + df['run'])
+    df = pair_runs(df)
+    df['run_key'] = df['strategy'] + ':' + df['run']
+    df = df.drop_duplicates(['filename', 'run_key'], keep='last')
+    wide = df.pivot(index='filename', columns='run_key', values='pred').dropna()
+    origins = df.pivot(index='filename', columns='run_key', values='origin').loc[wide.index, wide.columns]
+    labels = np.select([wide.to_numpy() == 'spliced', wide.to_numpy() == 'authentic'], [1, 0], -1)
+    origins = pd.factorize(origins.to_numpy().ravel())[0].reshape(origins.shape)
+    images = df.drop_duplicates('filename').set_index('filename').loc[wide.index].reset_index()
+    return images, list(wide.columns), labels, origins
+
+def stratified_indices(strata, replicates, rng):
+    """Return a (replicates, n) index matrix that resamples every stratum with replacement within itself."""
+    order = np.argsort(strata, kind='stable')
+    _, starts, sizes = np.unique(strata[order], return_index=True, return_counts=True)
+    start = np.repeat(starts, sizes)
+    size = np.repeat(sizes, sizes)
+    offsets = (rng.random((replicates, len(order))) * size).astype(np.int64)
+    return order[start + offsets]
+
+def bootstrap_scores(truth, pred, strata, replicates, rng):
+    """Return (accuracy, f1) arrays over the bootstrap replicates; invalid answers are left out of both."""
+    accuracy = np.empty(replicates)
+    f1 = np.empty(replicates)
+    for begin in range(0, replicates, BLOCK_SIZE):
+        end = min(begin + BLOCK_SIZE, replicates)
+        index = stratified_indices(strata, end - begin, rng)
+        t, p = truth[index], pred[index]
+        valid = p >= 0
+        tp = ((p == 1) & (t == 1)).sum(axis=1)
+        fp = ((p == 1) & (t == 0)).sum(axis=1)
+        fn = ((p == 0) & (t == 1)).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            accuracy[begin:end] = ((p == t) & valid).sum(axis=1) / valid.sum(axis=1)
+            f1[begin:end] = 2 * tp / (2 * tp + fp + fn)
+    return accuracy, f1
+
+def point_scores(truth, pred):
+    valid = pred >= 0
+    tp = np.sum((pred == 1) & (truth == 1))
+    fp = np.sum((pred == 1) & (truth == 0))
+    fn = np.sum((pred == 0) & (truth == 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sum((pred == truth) & valid) / np.sum(valid), 2 * tp / (2 * tp + fp + fn)
+
+def confidence_intervals(images, runs, labels, replicates=DEFAULT_REPLICATES, level=0.95, seed=0):
+    """Return accuracy and F1 with stratified bootstrap intervals per run, overall and by category.
+
+    Resampling is stratified by ground truth and category, so every replicate keeps
+    the class and category mix of the evaluated sample.
+    """
+    rng = np.random.default_rng(seed)
+    tail = (1 - level) / 2 * 100
+    memberships = category_memberships(images.assign(row=np.arange(len(images))))
+    groups = [('all', np.arange(len(images)))] + [
+        (category, rows['row'].to_numpy()) for category, rows in memberships.groupby('category_group')
+    ]
+    truth = (images['truth'] == 'spliced').to_numpy().astype(int)
+
+    records = []
+    for category, rows in groups:
+        strata = pd.factorize(images['truth'].iloc[rows] + ':' +
+                              images['category'].fillna(images['src_category']).iloc[rows].fillna(''))[0]
+        for j, run in enumerate(runs):
+            accuracy, f1 = bootstrap_scores(truth[rows], labels[rows, j], strata, replicates, rng)
+            point_accuracy, point_f1 = point_scores(truth[rows], labels[rows, j])
+            acc_lo, acc_hi = np.nanpercentile(accuracy, [tail, 100 - tail])
+            f1_lo, f1_hi = np.nanpercentile(f1, [tail, 100 - tail]) if not np.all(np.isnan(f1)) else (np.nan, np.nan)
+            records.append({
+                'run': run, 'category': category, 'n': len(rows),
+                'accuracy': point_accuracy, 'accuracy_lo': acc_lo, 'accuracy_hi': acc_hi,
+                'f1': point_f1, 'f1_lo': f1_lo, 'f1_hi': f1_hi,
+            })
+    return pd.DataFrame(records).set_index(['run', 'category'])
+
+def independent_pairs(origins):
+    """Return an (images, runs, runs) mask of the answer pairs read from different runs.
+
+    A spliced-only repeat borrows the base run's authentic answers, which would
+    otherwise count as perfect agreement with the base run.
+    """
+    return origins[:, :, None] != origins[:, None, :]
+
+def independent_rows(origins):
+    """Return the images whose answers in every run come from distinct runs."""
+    ordered = np.sort(origins, axis=1)
+    return np.all(np.diff(ordered, axis=1) != 0, axis=1)
+
+def cohen_kappa_matrix(labels, origins):
+    """Return the pairwise Cohen's kappa between runs over images both answered validly and independently."""
+    m = labels.shape[1]
+    kappa = np.full((m, m), np.nan)
+    independent = independent_pairs(origins)
+    for a in range(m):
+        for b in range(m):
+            if a == b:
+                kappa[a, b] = 1.0
+                continue
+            valid = (labels[:, a] >= 0) & (labels[:, b] >= 0) & independent[:, a, b]
+            if not valid.any():
+                continue
+            x, y = labels[valid, a], labels[valid, b]
+            observed = np.mean(x == y)
+            expected = np.mean(x) * np.mean(y) + np.mean(1 - x) * np.mean(1 - y)
+            kappa[a, b] = (observed - expected) / (1 - expected) if expected < 1 else 1.0
+    return kappa
+
+def fleiss_kappa(labels, origins):
+    """Return Fleiss' kappa across all runs over images every run answered validly and independently."""
+    labels = labels[np.all(labels >= 0, axis=1) & independent_rows(origins)]
+    if not len(labels):
+        return np.nan
+    n_images, m = labels.shape
+    spliced = labels.sum(axis=1)
+    counts = np.stack([m - spliced, spliced], axis=1)
+    agreement = (np.sum(counts ** 2, axis=1) - m) / (m * (m - 1))
+    proportions = counts.sum(axis=0) / (n_images * m)
+    expected = np.sum(proportions ** 2)
+    return (agreement.mean() - expected) / (1 - expected) if expected < 1 else 1.0
+
+def flip_rate_matrix(labels, origins):
+    """Return the fraction of images whose label differs between each pair of runs, over independent answers."""
+    independent = independent_pairs(origins)
+    flips = (labels[:, :, None] != labels[:, None, :]) & independent
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = flips.sum(axis=0) / independent.sum(axis=0)
+    np.fill_diagonal(rates, 0.0)
+    return rates
+
+def main():
+    parser = argparse.ArgumentParser(description="Bootstrap intervals and agreement across repeated runs")
+    parser.add_argument("runs", nargs="?", default="results/*_llm_decisions_few_shot*.csv",
+                        help="Glob of the results CSVs to align")
+    parser.add_argument("--replicates", type=int, default=DEFAULT_REPLICATES)
+    parser.add_argument("--level", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    images, runs, labels, origins = label_matrix(load_results(args.runs))
+    print(f"Aligned {len(runs)} runs over {len(images)} images decided in every run")
+
+    intervals = confidence_intervals(images, runs, labels, args.replicates, args.level, args.seed)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200,
+                           'display.precision', 4):
+        print(intervals)
+        if len(runs) > 1:
+            independent = independent_rows(origins)
+            print("\nAgreement is measured only between answers read from different results files")
+            print("\nCohen's kappa")
+            print(pd.DataFrame(cohen_kappa_matrix(labels, origins), index=runs, columns=runs))
+            print("\nFlip rate")
+            print(pd.DataFrame(flip_rate_matrix(labels, origins), index=runs, columns=runs))
+            print(f"\nFleiss' kappa = {fleiss_kappa(labels, origins):.4f} over {independent.sum()} images")
+            flipped = labels[independent].min(axis=1) != labels[independent].max(axis=1)
+            print(f"Images with any flip = {flipped.mean() if len(flipped) else np.nan:.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ Analyze the detection results for Authentic samples
 """
 
 import pandas as pd
+from metrics import normalize_decisions
 
 def analyze():
     # Load the CSV file
@@ -10,7 +11,7 @@ def analyze():
     df = pd.read_csv(file_path)
 
     # Normalize and parse decisions
-    df['LLM-decision'] = df['LLM-decision'].str.strip().str.lower()
+    df['LLM-decision'] = normalize_decisions(df['LLM-decision'].fillna(''))
 
     # Extract category from filename (assumes format like Au_arc_XXXXX.jpg)
     df['category'] = df['filename'].str.extract(r'Au_(\w+)_\d+')
@@ -2,6 +2,7 @@
 Analyze the detection results for Spliced samples
 """
 import pandas as pd
+from metrics import normalize_decisions
 
 def analyze():
     # Load the splicing result CSV
@@ -9,7 +10,7 @@ def analyze():
     df = pd.read_csv(file_path)
 
     # Normalize decision labels
-    df['LLM-decision'] = df['LLM-decision'].str.strip().str.lower()
+    df['LLM-decision'] = normalize_decisions(df['LLM-decision'].fillna(''))
 
     # Calculate total counts
     total_authentic = (df['LLM-decision'] == 'authentic').sum()
@@ -0,0 +1,163 @@
+"""
+Offline evaluation through the OpenAI Batch API
+"""
+
+import argparse
+import glob
+import json
+import os
+from openai.types.chat import ChatCompletion
+from journal import Journal, journal_path, read_journal, read_journal_samples, read_journal_scores, write_results_csv
+from verdict import extract_decision, response_samples, vote_columns
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# The Batch API accepts at most 50,000 requests and 200 MB per input file
+MAX_SHARD_REQUESTS = 50_000
+MAX_SHARD_BYTES = 190 * 1024 * 1024
+
+def batch_stem(batch_dir, output_csv):
+    """Return the path prefix of every batch file belonging to a results CSV."""
+    return os.path.join(batch_dir, os.path.splitext(os.path.basename(output_csv))[0])
+
+def build_batch_shards(image_paths, build_request, stem,
+                       max_bytes=MAX_SHARD_BYTES, max_requests=MAX_SHARD_REQUESTS):
+    """Stream one batch line per image into size-capped `<stem>.<i>.jsonl` shards and return their paths.
+
+    A new build replaces the shards, outputs and batch ids left by the previous one.
+    """
+    os.makedirs(os.path.dirname(stem) or ".", exist_ok=True)
+    for stale in glob.glob(f"{glob.escape(stem)}.*.jsonl") + glob.glob(f"{glob.escape(stem)}.batches.json"):
+        os.remove(stale)
+
+    shard_paths = []
+    shard = None
+    shard_bytes = shard_requests = 0
+
+    for path in image_paths:
+        line = json.dumps({
+            "custom_id": os.path.basename(path),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": build_request(path),
+        }, separators=(',', ':')).encode('utf-8') + b"\n"
+
+        if shard is None or shard_bytes + len(line) > max_bytes or shard_requests >= max_requests:
+            if shard is not None:
+                shard.close()
+            shard_paths.append(f"{stem}.{len(shard_paths)}.jsonl")
+            shard = open(shard_paths[-1], 'wb')
+            shard_bytes = shard_requests = 0
+
+        shard.write(line)
+        shard_bytes += len(line)
+        shard_requests += 1
+
+    if shard is not None:
+        shard.close()
+    print(f"Wrote {len(image_paths)} requests to {len(shard_paths)} batch shard(s) at {stem}.*.jsonl")
+    return shard_paths
+
+def submit_batch_shards(client, shard_paths, stem):
+    """Upload each shard, create its batch job and save the batch ids to `<stem>.batches.json`."""
+    batch_ids = []
+    for shard_path in shard_paths:
+        with open(shard_path, 'rb') as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+        print(f"Submitted {shard_path} as batch {batch.id}")
+        batch_ids.append(batch.id)
+
+    with open(f"{stem}.batches.json", 'w') as f:
+        json.dump(batch_ids, f, indent=2)
+    return batch_ids
+
+def download_batch_outputs(client, stem):
+    """Download the output of every finished batch and return True when none are still running."""
+    with open(f"{stem}.batches.json") as f:
+        batch_ids = json.load(f)
+
+    finished = True
+    for i, batch_id in enumerate(batch_ids):
+        output_path = f"{stem}.{i}.output.jsonl"
+        if os.path.exists(output_path):
+            continue
+        batch = client.batches.retrieve(batch_id)
+        print(f"Batch {batch_id}: {batch.status}")
+        if batch.status not in ("completed", "failed", "expired", "cancelled"):
+            finished = False
+            continue
+
+        # Failed requests are reported in a separate error file with the same line format
+        with open(output_path, 'wb') as out:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    out.write(client.files.content(file_id).read())
+    return finished
+
+def parse_batch_line(entry):
+    """Return the (filename, decision, score, samples) of one line of batch output."""
+    response = entry.get("response") or {}
+    if entry.get("error") or response.get("status_code") != 200:
+        error = entry.get("error") or response.get("body", {}).get("error") or response.get("status_code")
+        return entry["custom_id"], f"ERROR: {error}", None, None
+    completion = ChatCompletion.model_validate(response["body"])
+    return (entry["custom_id"], *extract_decision(completion), response_samples(completion))
+
+def ingest_batch_outputs(stem, output_csv, filenames):
+    """Record every `<stem>.*.output.jsonl` decision in the journal and rebuild the results CSV."""
+    journal = Journal(journal_path(output_csv))
+    count = 0
+    for output_path in sorted(glob.glob(f"{glob.escape(stem)}.*.output.jsonl")):
+        with open(output_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    journal.record(*parse_batch_line(json.loads(line)))
+                    count += 1
+    journal.close()
+
+    path = journal_path(output_csv)
+    write_results_csv(output_csv, read_journal(path), filenames, read_journal_scores(path),
+                      vote_columns(read_journal_samples(path)))
+    print(f"Ingested {count} batch results into {output_csv}")
+
+def run_local_batch(input_path, output_path, reply="Authentic"):
+    """Stand-in for the Batch API: answer every request of a shard with a canned reply."""
+    with open(input_path, encoding='utf-8') as f_in, open(output_path, 'w', encoding='utf-8') as f_out:
+        for i, line in enumerate(f_in):
+            request = json.loads(line)
+            body = {
+                "id": f"chatcmpl-local-{i}",
+                "object": "chat.completion",
+                "created": 0,
+                "model": request["body"]["model"],
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": reply},
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 1, "total_tokens": 1},
+            }
+            f_out.write(json.dumps({
+                "id": f"batch_req_local_{i}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": f"local-{i}", "body": body},
+                "error": None,
+            }) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a batch input shard locally with a canned reply")
+    parser.add_argument("input", help="Batch input JSONL shard")
+    parser.add_argument("output", nargs="?", help="Output JSONL (default: <input>.output.jsonl)")
+    parser.add_argument("--reply", default="Authentic")
+    args = parser.parse_args()
+
+    output_path = args.output or args.input.replace(".jsonl", ".output.jsonl")
+    run_local_batch(args.input, output_path, args.reply)
+    print(f"Wrote canned batch output to {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Runner benchmark against a local OpenAI-compatible stand-in server over synthetic CASIA-like images
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from PIL import Image
+from tokens import estimate_request_tokens
+
+DEFAULT_RESULTS = "benchmarks/results.jsonl"
+DEFAULT_DATA_DIR = ".cache/benchmark"
+CATEGORIES = ('ani', 'arc', 'cha')
+# Columns printed when comparing runs across commits
+REPORT_COLUMNS = ['images_per_s', 'run_s', 'build_cpu_s', 'preprocess_cpu_s', 'peak_rss_mb',
+                  'cached_share', 'retries', 'errors']
+
+def make_stub_handler(latency=0.2, jitter=0.05, error_rate=0.0, rate_limit_rate=0.0, seed=0):
+    """Return a request handler answering chat completions like the OpenAI API after a simulated delay.
+
+    A fraction `error_rate` of requests fail with a 500 and `rate_limit_rate` with a
+    429 carrying `retry-after-ms`; successful replies carry `x-ratelimit-*` headers,
+    token usage and, when asked for, logprobs. Like the provider's prompt cache, an
+    example prefix of at least 1024 tokens that an earlier request finished
+    processing is reported as cached tokens.
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    seen_prefixes = set()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, headers=()):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        @staticmethod
+        def _prefix(request):
+            """Return a key and token count of everything before the target (last) image, if examples precede it."""
+            content = request["messages"][-1]["content"]
+            image_parts = ([i for i, part in enumerate(content) if part["type"] == "image_url"]
+                           if isinstance(content, list) else [])
+            if len(image_parts) < 2:
+                return None, 0
+            messages = [{"role": "user", "content": content[:image_parts[-1]]}]
+            return json.dumps(messages, sort_keys=True), estimate_request_tokens(dict(messages=messages))
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt_tokens = estimate_request_tokens(dict(request, max_tokens=0, n=1))
+            prefix_key, prefix_tokens = self._prefix(request)
+            with lock:
+                delay = max(0.0, rng.gauss(latency, jitter))
+                draw = rng.random()
+                answers = [rng.choice(["Authentic", "Spliced"]) for _ in range(request.get("n") or 1)]
+                prefix_cached = prefix_key in seen_prefixes and prefix_tokens >= 1024
+            time.sleep(delay)
+
+            if draw < rate_limit_rate:
+                self._send(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                           "code": "rate_limit_exceeded"}}, [("retry-after-ms", "100")])
+                return
+            if draw < rate_limit_rate + error_rate:
+                self._send(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                return
+
+            # Answers are two tokens, the first being their first four letters, cut at max_tokens like the API
+            max_tokens = request.get("max_tokens") or request.get("max_completion_tokens") or 2
+            choices = []
+            for i, answer in enumerate(answers):
+                content = answer if max_tokens >= 2 else answer[:4]
+                choice = {"index": i, "finish_reason": "stop" if max_tokens >= 2 else "length",
+                          "message": {"role": "assistant", "content": content}}
+                if request.get("logprobs"):
+                    top = [{"token": answer[:4], "logprob": -0.05, "bytes": None},
+                           {"token": "Spl" if answer == "Authentic" else "Auth", "logprob": -3.0, "bytes": None}]
+                    choice["logprobs"] = {"content": [{"token": answer[:4], "logprob": -0.05, "bytes": None,
+                                                       "top_logprobs": top}]}
+                choices.append(choice)
+            # The prefix becomes cacheable once a request carrying it has been processed
+            with lock:
+                seen_prefixes.add(prefix_key)
+            cached_tokens = prefix_tokens // 128 * 128 if prefix_cached else 0
+            self._send(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": request["model"], "choices": choices,
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(choices) * min(max_tokens, 2),
+                          "total_tokens": prompt_tokens + len(choices) * min(max_tokens, 2),
+                          "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+            }, [("x-ratelimit-limit-requests", "10000"), ("x-ratelimit-remaining-requests", "9999"),
+                ("x-ratelimit-limit-tokens", "30000000"), ("x-ratelimit-remaining-tokens", "29990000")])
+
+    return StubHandler
+
+def start_stub_server(port=0, **options):
+    """Serve the stand-in API from a background thread and return (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_stub_handler(**options))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def synthetic_image(rng, size, spliced):
+    """Return a textured RGB image; spliced ones get a pasted patch with different statistics."""
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    base = rng.uniform(0, 255, 3) + rng.uniform(-0.3, 0.3, 3) * (x[..., None] + y[..., None])
+    pixels = base + rng.normal(0, 12, (height, width, 3))
+    if spliced:
+        h, w = height // 3, width // 3
+        top, left = rng.integers(0, height - h), rng.integers(0, width - w)
+        pixels[top:top + h, left:left + w] = rng.uniform(0, 255, 3) + rng.normal(0, 4, (h, w, 3))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+def generate_dataset(n_images, size=(384, 256), seed=0, root=DEFAULT_DATA_DIR):
+    """Write (once) n synthetic targets named like CASIA v2.0, plus example pools and CoT notes."""
+    data_dir = os.path.join(root, f"{n_images}_{size[0]}x{size[1]}_{seed}")
+    if os.path.exists(os.path.join(data_dir, "complete")):
+        return data_dir
+
+    rng = np.random.default_rng(seed)
+    folders = {name: os.path.join(data_dir, name)
+               for name in ("targets", "Au_additional", "Sp_additional", "Au_CoT", "Sp_CoT")}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    def write(folder, filename, spliced):
+        synthetic_image(rng, size, spliced).save(os.path.join(folders[folder], filename), quality=90)
+
+    for i in range(n_images):
+        category, other = CATEGORIES[i % 3], CATEGORIES[(i // 3) % 3]
+        if i % 2:
+            write("targets", f"Tp_D_CNN_M_N_{category}{i:05d}_{other}{i:05d}_{10000 + i}.jpg", True)
+        else:
+            write("targets", f"Au_{category}_{i:05d}.jpg", False)
+
+    for category in CATEGORIES:
+        for i in range(2):
+            au_name = f"Au_{category}_9{i:04d}"
+            sp_name = f"Tp_D_CNN_M_N_{category}9{i:04d}_{category}9{i + 10:04d}_9{i:04d}"
+            write("Au_additional", au_name + ".jpg", False)
+            write("Sp_additional", sp_name + ".jpg", True)
+            for folder, name, label in (("Au_CoT", au_name, "authentic"), ("Sp_CoT", sp_name, "spliced")):
+                with open(os.path.join(folders[folder], name + ".txt"), 'w') as f:
+                    f.write(f"The lighting, noise and edges are consistent with a {label} {category} image.")
+
+    open(os.path.join(data_dir, "complete"), 'w').close()
+    return data_dir
+
+def make_builder(strategy, data_dir):
+    """Return the strategy's request builder over the synthetic example pools."""
+    import evaluate
+    pools = [os.path.join(data_dir, name) for name in ("Au_additional", "Sp_additional", "Au_CoT", "Sp_CoT")]
+    arguments = {"zero_shot": [], "few_shot": pools[:2], "fewshot_with_cot": pools}[strategy]
+    return evaluate.STRATEGIES[strategy](*arguments)
+
+def run_case(strategy, data_dir, base_url, concurrency, workers, order="input"):
+    """Time one strategy end to end (preprocessing, prompt building and requests) in this process."""
+    # The strategy modules create their API clients on import, so only the child processes load them
+    from openai import AsyncOpenAI
+    import preprocess
+    from journal import is_error, read_results_csv
+    from runner import category_order, run_strategies_async, with_prompt_cache_key
+    from scheduler import Scheduler
+    from telemetry import trace_path
+    from zeroshot import get_all_image_paths
+
+    # The preprocessing cache, results CSV and trace of a case are removed with it
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as work_dir:
+        preprocess.configure(True, cache_dir=os.path.join(work_dir, "images"))
+        image_paths = get_all_image_paths(os.path.join(data_dir, "targets"))
+        build_request = make_builder(strategy, data_dir)
+        output_csv = os.path.join(work_dir, f"{strategy}.csv")
+        if order == "category":
+            build_request = with_prompt_cache_key(build_request, output_csv)
+
+        build_cpu = []
+        def timed_build(image_path, image_url=None):
+            start = time.thread_time()
+            request = build_request(image_path, image_url)
+            build_cpu.append(time.thread_time() - start)
+            return request
+
+        # Preprocessing runs inside the runner's reader/encoder stage, so it is part of the run time
+        started = time.perf_counter()
+
+        scheduler = Scheduler()
+        client = AsyncOpenAI(base_url=base_url, api_key="benchmark", max_retries=0)
+        asyncio.run(run_strategies_async(image_paths, {output_csv: timed_build}, concurrency, fresh=True,
+                                         client=client, scheduler=scheduler,
+                                         order=category_order if order == "category" else None, workers=workers))
+        finished = time.perf_counter()
+
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        decisions = read_results_csv(output_csv)
+        with open(trace_path(output_csv), encoding='utf-8') as f:
+            usage = [json.loads(line) for line in f]
+        prompt_tokens = sum(entry["prompt_tokens"] for entry in usage)
+        return {
+            "images": len(image_paths),
+            "run_s": finished - started,
+            "images_per_s": len(image_paths) / (finished - started),
+            "build_cpu_s": sum(build_cpu),
+            "preprocess_cpu_s": children.ru_utime + children.ru_stime,
+            "process_cpu_s": own.ru_utime + own.ru_stime,
+            # ru_maxrss is in KiB on Linux
+            "peak_rss_mb": own.ru_maxrss / 1024,
+            "preprocess_peak_rss_mb": children.ru_maxrss / 1024,
+            "cached_share": sum(entry["cached_tokens"] for entry in usage) / prompt_tokens if prompt_tokens else 0.0,
+            "retries": scheduler.retries,
+            "errors": sum(is_error(decision) for decision in decisions.values()),
+        }
+
+def git_commit():
+    """Return the current commit SHA and whether the working tree has uncommitted changes."""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        sha = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_dir,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return sha, dirty
+
+def compare_commits(results_path, params):
+    """Return the latest result per commit and strategy among the runs with the same parameters."""
+    df = pd.read_json(results_path, lines=True)
+    for key, value in params.items():
+        df = df[df[key] == value] if key in df else df.iloc[0:0]
+    # A trailing + marks a run of uncommitted changes on top of that commit
+    df['commit'] = df['commit'].fillna('unknown').str[:10] + np.where(df['dirty'].fillna(False), '+', '')
+    latest = df.sort_values('timestamp').groupby(['commit', 'strategy'], sort=False).last()
+    return latest.sort_values('timestamp')[REPORT_COLUMNS]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--images", type=int, default=300, help="Number of synthetic target images")
+    parser.add_argument("--size", default="384x256", help="Synthetic image size, WIDTHxHEIGHT")
+    parser.add_argument("--strategies", nargs="+", choices=["zero_shot", "few_shot", "fewshot_with_cot"],
+                        default=["zero_shot", "few_shot", "fewshot_with_cot"])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, help="Preprocessing processes (default: one per core)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--order", choices=["input", "category"], default="input",
+                        help="Request order passed to the runner, see runner.py --order")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSONL file the results are appended to")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Each case runs in its own process so CPU time and peak RSS are its own
+        result = run_case(args.child, args.data_dir, args.base_url, args.concurrency, args.workers, args.order)
+        print(json.dumps(result))
+        return
+
+    size = tuple(int(side) for side in args.size.lower().split("x"))
+    data_dir = generate_dataset(args.images, size, args.seed)
+    server, base_url = start_stub_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                         rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    commit, dirty = git_commit()
+    params = {"images": args.images, "size": args.size, "concurrency": args.concurrency,
+              "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+              "rate_limit_rate": args.rate_limit_rate, "order": args.order}
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "benchmark"))
+
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    for strategy in args.strategies:
+        command = [sys.executable, os.path.abspath(__file__), "--child", strategy, "--data-dir", data_dir,
+                   "--base-url", base_url, "--concurrency", str(args.concurrency), "--order", args.order]
+        if args.workers:
+            command += ["--workers", str(args.workers)]
+        proc = subprocess.run(command, capture_output=True, text=True, env=env)
+        if proc.returncode != 0:
+            print(f"{strategy} failed:\n{proc.stderr[-2000:]}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        record = {"timestamp": datetime.now(timezone.utc).isoformat(), "commit": commit, "dirty": dirty,
+                  "strategy": strategy, **params, **result}
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"{strategy}: {result['images_per_s']:.1f} images/s, build CPU {result['build_cpu_s']:.2f}s, "
+              f"preprocess CPU {result['preprocess_cpu_s']:.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    server.shutdown()
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200,
+                           'display.precision', 3):
+        print(compare_commits(args.results, params))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+On-disk cache of model responses keyed by a hash of the full request
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from openai.types.chat import ChatCompletion
+
+DEFAULT_CACHE_PATH = ".cache/responses.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def request_key(request):
+    """Return the SHA-256 of a request's canonical JSON form.
+
+    The request holds the model, temperature, max_tokens and every message part,
+    including the base64 image bytes, so any change to them yields a new key.
+    """
+    payload = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """SQLite store of chat completion responses with least-recently-used eviction."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    def get(self, request):
+        """Return the cached ChatCompletion for a request, or None on a miss."""
+        key = request_key(request)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return ChatCompletion.model_validate_json(row[0])
+
+    def put(self, request, response):
+        """Store a response and evict the least recently used entries past the size budget."""
+        payload = response.model_dump_json()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                (request_key(request), payload, len(payload), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def cached_create(client, request, cache=None, scheduler=None, stats=None):
+    """Create a chat completion, answering from the cache without a network call when possible.
+
+    Misses go through the scheduler's rate limits and retries when one is given.
+    `stats`, when given, records whether the cache answered and the network latency.
+    """
+    stats = {} if stats is None else stats
+    if cache is not None:
+        response = cache.get(request)
+        stats["cache_hit"] = response is not None
+        if response is not None:
+            return response
+    if scheduler is not None:
+        response = scheduler.create(client, request, stats)
+    else:
+        sent = time.perf_counter()
+        response = client.chat.completions.create(**request)
+        stats["latency"] = time.perf_counter() - sent
+    if cache is not None:
+        cache.put(request, response)
+    return response
+
+async def cached_create_async(client, request, cache=None, scheduler=None, stats=None):
+    """Async counterpart of `cached_create` for an AsyncOpenAI client."""
+    stats = {} if stats is None else stats
+    if cache is not None:
+        response = cache.get(request)
+        stats["cache_hit"] = response is not None
+        if response is not None:
+            return response
+    if scheduler is not None:
+        response = await scheduler.create_async(client, request, stats)
+    else:
+        sent = time.perf_counter()
+        response = await client.chat.completions.create(**request)
+        stats["latency"] = time.perf_counter() - sent
+    if cache is not None:
+        cache.put(request, response)
+    return response
@@ -0,0 +1,184 @@
+"""
+Cascade evaluation: zero-shot on every image, escalating only uncertain answers to few-shot and then few-shot CoT
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import zeroshot
+from evaluate import STRATEGIES, output_path
+from journal import is_error, write_results_csv
+from results_store import read_decisions
+from runner import build_arg_parser, parse_args, run_strategies_with_args
+from telemetry import load_traces, request_cost, trace_path
+from verdict import parse_decision, verdict_request
+
+STAGES = ("zero_shot", "few_shot", "fewshot_with_cot")
+CASCADE_DIR = "cascade"
+DEFAULT_MARGIN = 0.5       # minimum |P(spliced) - P(authentic)| an answer needs to stop the cascade
+REPEAT_TEMPERATURE = 1.0   # sampling temperature of the cheap repeats
+
+def stage_output(output_dir, folder, strategy):
+    """Return the partial results CSV of one stage, e.g. results/cascade/Sp_sample_llm_decisions_cascade_few_shot.csv.
+
+    Stage outputs only hold the images that reached the stage, so they are kept
+    out of the results/*.csv globs of the analyses, and their strategy name keeps
+    their rows in the results store and traces apart from full runs of the strategy.
+    """
+    return os.path.join(output_dir, CASCADE_DIR,
+                        os.path.basename(output_path(output_dir, folder, f"{CASCADE_DIR}_{strategy}")))
+
+def make_stage_builder(build_request, final=False, repeats=1):
+    """Wrap a strategy's request builder for one cascade stage.
+
+    Escalating stages ask for a scored single-token verdict, sampled `repeats`
+    times in one request when above 1. The final stage keeps the strategy's own
+    prompt (the CoT reasoning included), since its answer is taken as it is.
+    """
+    if final:
+        return build_request
+
+    def build_stage_request(image_path, image_url=None):
+        request = verdict_request(build_request(image_path, image_url))
+        if repeats > 1:
+            request.update(n=repeats, temperature=REPEAT_TEMPERATURE)
+        return request
+    return build_stage_request
+
+def is_uncertain(decision, score, repeats=1, margin=DEFAULT_MARGIN):
+    """Return whether a stage's answer should be escalated to the next stage.
+
+    Unparseable answers are escalated, and so are answers whose P(spliced) lies
+    within `margin` of a coin flip, or, with repeats, whose samples disagree.
+    Unscored answers that parse are kept; failed requests stay errors.
+    """
+    if is_error(decision):
+        return False
+    if parse_decision(decision) is None:
+        return True
+    if score is None or np.isnan(score):
+        return False
+    if repeats > 1 and 0 < score < 1:
+        return True
+    return abs(2 * score - 1) < margin
+
+def stage_costs(stage_csv, filenames):
+    """Return the API-priced cost of the latest successful request of each image at one stage.
+
+    Answers served by the local response cache are priced like the original call.
+    """
+    path = trace_path(stage_csv)
+    if not os.path.exists(path):
+        return pd.Series(dtype=float)
+    df = load_traces(path)
+    df = df[df['filename'].isin(filenames) & df['error'].isna()].drop_duplicates('filename', keep='last')
+    if 'model' not in df:
+        return pd.Series(np.nan, index=df['filename'])
+    costs = [request_cost(model, prompt, cached, completion) if isinstance(model, str) else None
+             for model, prompt, cached, completion in
+             df[['model', 'prompt_tokens', 'cached_tokens', 'completion_tokens']].itertuples(index=False)]
+    return pd.Series(costs, index=df['filename'], dtype=float)
+
+def accuracy(decisions, filenames):
+    """Return the share of the images whose decision matches the ground truth in their filename."""
+    truth = {name: 'spliced' if name.startswith('Tp_') else 'authentic' for name in filenames}
+    decided = [name for name in filenames if name in decisions]
+    if not decided:
+        return np.nan
+    return sum(parse_decision(decisions[name]) == truth[name] for name in decided) / len(decided)
+
+def report(stages, reached, stage_decisions, decided_by, decisions, costs, output_dir, folder):
+    """Return the accuracy and cost of the cascade next to running each stage's strategy on every image.
+
+    A strategy alone is costed at its mean cost per request in the cascade times
+    the number of images. Its accuracy comes from its results CSV in the output
+    folder when there is one (a full run), otherwise from the images that reached
+    its stage of the cascade (`decided` counts the images it is measured on).
+    """
+    filenames = reached[stages[0]]
+    rows = []
+    for stage in stages:
+        baseline = output_path(output_dir, folder, stage)
+        if os.path.exists(baseline):
+            alone = {name: decision for name, decision, _, _ in read_decisions(baseline)}
+            source = os.path.basename(baseline)
+        else:
+            alone = stage_decisions[stage]
+            source = "cascade stage"
+        rows.append({
+            "strategy": stage, "images": len(filenames),
+            "accuracy": accuracy(alone, filenames), "accuracy_source": source,
+            "requests": len(filenames), "decided": sum(name in alone for name in filenames),
+            "cost_usd": costs[stage].mean() * len(filenames) if len(costs[stage]) else np.nan,
+        })
+    rows.append({
+        "strategy": "cascade", "images": len(filenames),
+        "accuracy": accuracy(decisions, filenames), "accuracy_source": "cascade",
+        "requests": sum(len(reached[stage]) for stage in stages), "decided": len(decisions),
+        "cost_usd": sum(costs[stage].sum() for stage in stages),
+    })
+    table = pd.DataFrame(rows).set_index("strategy")
+    table["cost_per_1k_images"] = table["cost_usd"] / table["images"] * 1000
+    by_stage = pd.Series(decided_by).value_counts().reindex(list(stages), fill_value=0)
+    return table, by_stage
+
+def main():
+    parser = build_arg_parser(__doc__, "CASIA2/Sp_sample", None)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                        help="Strategies of the cascade, cheapest first")
+    parser.add_argument("--margin", type=float, default=DEFAULT_MARGIN,
+                        help="Escalate answers whose |P(spliced) - P(authentic)| is below this")
+    parser.add_argument("--repeats", type=int, default=1,
+                        help="Verdicts sampled per request at the escalating stages; any disagreement escalates")
+    parser.add_argument("--output-dir", default="results",
+                        help="Folder of the cascade's results CSV; stage outputs go to its cascade/ subfolder")
+    args = parse_args(parser)
+    if args.verdict or args.batch or args.shard or args.pack > 1:
+        parser.error("the cascade sets its own verdict requests and cannot run with --verdict, --batch, --shard "
+                     "or --pack")
+
+    image_paths = zeroshot.get_all_image_paths(args.folder)
+    filenames = [os.path.basename(path) for path in image_paths]
+    remaining = image_paths
+    reached, stage_decisions, costs = {}, {}, {}
+    decisions, scores, decided_by = {}, {}, {}
+    for i, stage in enumerate(args.stages):
+        final = i == len(args.stages) - 1
+        stage_csv = stage_output(args.output_dir, args.folder, stage)
+        reached[stage] = [os.path.basename(path) for path in remaining]
+        if remaining:
+            print(f"\nStage {i + 1} ({stage}): {len(remaining)} images")
+            builder = make_stage_builder(STRATEGIES[stage](), final, args.repeats)
+            run_strategies_with_args(remaining, {stage_csv: builder}, args)
+
+        stage_decisions[stage] = {}
+        escalated, arrived = set(), set(reached[stage])
+        for filename, decision, score, _ in read_decisions(stage_csv) if remaining else []:
+            if filename not in arrived:
+                continue
+            stage_decisions[stage][filename] = decision
+            if not final and is_uncertain(decision, score, args.repeats, args.margin):
+                escalated.add(filename)
+                continue
+            decisions[filename] = decision
+            decided_by[filename] = stage
+            if not np.isnan(score):
+                scores[filename] = score
+        costs[stage] = stage_costs(stage_csv, reached[stage])
+        remaining = [path for path in remaining if os.path.basename(path) in escalated]
+
+    output_csv = output_path(args.output_dir, args.folder, "cascade")
+    write_results_csv(output_csv, decisions, filenames, scores, {"Stage": decided_by})
+    print(f"\nCascade results saved to: {output_csv}")
+
+    table, by_stage = report(args.stages, reached, stage_decisions, decided_by, decisions, costs,
+                             args.output_dir, args.folder)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200,
+                           'display.precision', 4):
+        print("\nImages decided per stage:")
+        print(by_stage.to_string())
+        print("\nAccuracy and cost against each strategy on every image:")
+        print(table)
+
+if __name__ == "__main__":
+    main()
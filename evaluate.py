@@ -0,0 +1,41 @@
+"""
+Evaluation of several prompt strategies in a single pass over the images
+"""
+
+import os
+import fewshot
+import fewshotCoT
+import zeroshot
+from runner import build_arg_parser, parse_args, run_strategies_with_args
+
+# Strategy names match the suffixes of the CSVs in results/
+STRATEGIES = {
+    "zero_shot": zeroshot.make_request_builder,
+    "few_shot": fewshot.make_request_builder,
+    "fewshot_with_cot": fewshotCoT.make_request_builder,
+}
+
+def output_path(output_dir, folder, strategy):
+    """Return the results CSV of a strategy, e.g. results/Sp_sample_llm_decisions_few_shot.csv."""
+    split = os.path.basename(os.path.normpath(folder))
+    return os.path.join(output_dir, f"{split}_llm_decisions_{strategy}.csv")
+
+def main():
+    parser = build_arg_parser(__doc__, "CASIA2/Sp_sample", None)
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES),
+                        help="Strategies to evaluate in this pass")
+    parser.add_argument("--output-dir", default="results",
+                        help="Folder the per-strategy results CSVs are written to")
+    args = parse_args(parser)
+
+    image_paths = zeroshot.get_all_image_paths(args.folder)
+
+    # Each image is read and encoded once and its data URL shared by every strategy's request
+    strategies = {
+        output_path(args.output_dir, args.folder, strategy): STRATEGIES[strategy]()
+        for strategy in args.strategies
+    }
+    run_strategies_with_args(image_paths, strategies, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+In-memory store of few-shot prompt prefixes built once per run
+"""
+
+import threading
+
+CATEGORIES = ('ani', 'arc', 'cha')
+
+def prefix_category(filename):
+    """Return the category whose prefix a target uses: the first of `CATEGORIES` named in its filename."""
+    return next((category for category in CATEGORIES if category in filename), None)
+
+class ExampleStore:
+    """Per-category prompt prefixes (example text and base64 image parts) shared by every query.
+
+    `build_prefix(category)` returns the message parts that precede the target image.
+    Prefixes are kept as tuples so a query can extend them without copying or mutating them.
+    """
+
+    def __init__(self, build_prefix, categories=CATEGORIES):
+        self._build_prefix = build_prefix
+        self._lock = threading.Lock()
+        self._prefixes = {category: tuple(build_prefix(category)) for category in categories}
+
+    def prefix(self, category):
+        """Return the prefix for a category, building it on first use."""
+        prefix = self._prefixes.get(category)
+        if prefix is None:
+            with self._lock:
+                if category not in self._prefixes:
+                    self._prefixes[category] = tuple(self._build_prefix(category))
+                prefix = self._prefixes[category]
+        return prefix
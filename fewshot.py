@@ -2,30 +2,28 @@
 Evaluation with Few-Shot Prompt Strategy
 """
 
-import base64
-import csv
+import functools
 import os
 import random
 from dotenv import load_dotenv
 from openai import OpenAI
+from cache import cached_create
+from example_store import ExampleStore
+from manifest import iter_image_paths
+from preprocess import image_data_url
+from retrieval import DescriptorIndex, compute_descriptor
+from runner import build_arg_parser, parse_args, run_with_args
+from scheduler import Scheduler
 
 # Load the OpenAI API key
 load_dotenv()
-client = OpenAI()
+# Retries are left to the scheduler, which paces them under the account's rate limits
+client = OpenAI(max_retries=0)
+scheduler = Scheduler()
 
 def get_all_image_paths(folder):
     """Return all image file paths in the folder with valid extensions."""
-    valid_extensions = ('.jpg', '.jpeg', '.png')
-    return [
-        os.path.join(folder, file_name)
-        for file_name in sorted(os.listdir(folder))
-        if file_name.lower().endswith(valid_extensions)
-    ]
-
-def encode_image_to_base64(image_path):
-    """Encode an image file to base64 string."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+    return sorted(iter_image_paths(folder))
 
 def extract_category_from_filename(filename):
     """Extract category from authentic or spliced filename."""
@@ -42,7 +40,10 @@ def select_few_shot_examples(input_filename, au_pool, sp_pool):
     """Select 2 matching authentic and 2 matching spliced examples based on input image's category."""
     filename = os.path.basename(input_filename)
     category = extract_category_from_filename(filename)
+    return select_examples_for_category(category, au_pool, sp_pool)
 
+def select_examples_for_category(category, au_pool, sp_pool):
+    """Select 2 authentic and 2 spliced examples whose filenames contain the category."""
     matching_au = []
     for p in au_pool:
         base = os.path.basename(p)
@@ -55,31 +56,35 @@ def select_few_shot_examples(input_filename, au_pool, sp_pool):
         if category in base:
             matching_sp.append(p)
 
-    random.seed(42)
+    # A private generator gives the same draws as random.seed(42) without racing other worker threads
+    rng = random.Random(42)
     # Fallback if not enough relevant examples
-    sampled_au = random.sample(matching_au, min(2, len(matching_au))) if matching_au else random.sample(au_pool, 2)
-    sampled_sp = random.sample(matching_sp, min(2, len(matching_sp))) if matching_sp else random.sample(sp_pool, 2)
+    sampled_au = rng.sample(matching_au, min(2, len(matching_au))) if matching_au else rng.sample(au_pool, 2)
+    sampled_sp = rng.sample(matching_sp, min(2, len(matching_sp))) if matching_sp else rng.sample(sp_pool, 2)
 
     return sampled_au, sampled_sp
 
-def generate_few_shot_prompt(auth_paths, splice_paths):
+def select_similar_examples(input_filename, au_index, sp_index, k=2):
+    """Select the k authentic and k spliced examples whose descriptors are nearest to the input image."""
+    descriptor = compute_descriptor(input_filename)
+    return au_index.nearest(descriptor, k), sp_index.nearest(descriptor, k)
+
+def generate_few_shot_prompt(auth_paths, splice_paths, encode=image_data_url):
     """Return few-shot image-text pairs for the system prompt."""
     messages = []
 
     for path in auth_paths:
-        base64_img = encode_image_to_base64(path)
         messages.append({"type": "text", "text": "For example, this image is Authentic."})
         messages.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}
+            "image_url": {"url": encode(path)}
         })
 
     for path in splice_paths:
-        base64_img = encode_image_to_base64(path)
         messages.append({"type": "text", "text": "For example, this image is Spliced."})
         messages.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}
+            "image_url": {"url": encode(path)}
         })
 
     # Final task prompt with reasoning instruction
@@ -91,54 +96,76 @@ def generate_few_shot_prompt(auth_paths, splice_paths):
 
     return messages
 
-def send_image_to_openai_with_fewshot(image_path, au_examples, sp_examples):
-    """Send the target image with few-shot examples to the model."""
-    few_shot_messages = generate_few_shot_prompt(au_examples, sp_examples)
+def build_request(image_path, au_examples, sp_examples):
+    """Return the chat completion arguments for the target image with few-shot examples."""
+    return build_request_with_prefix(image_path, generate_few_shot_prompt(au_examples, sp_examples))
 
-    base64_image = encode_image_to_base64(image_path)
-    few_shot_messages.append({
+def build_request_with_prefix(image_path, prefix, image_url=None):
+    """Return the chat completion arguments for the target image after a prebuilt few-shot prefix."""
+    few_shot_messages = [*prefix, {
         "type": "image_url",
-        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-    })
+        "image_url": {"url": image_url or image_data_url(image_path)}
+    }]
 
-    response = client.chat.completions.create(
+    return dict(
         model="gpt-4.1-2025-04-14",  # Vision-capable model
         messages=[{"role": "user", "content": few_shot_messages}],
         temperature=0,
         max_tokens=150
     )
+
+def send_image_to_openai_with_fewshot(image_path, au_examples, sp_examples, cache=None):
+    """Send the target image with few-shot examples to the model."""
+    response = cached_create(client, build_request(image_path, au_examples, sp_examples), cache, scheduler)
     result = response.choices[0].message.content.strip()
     print(result)
     return result
 
+def make_request_builder(au_dir="CASIA2/Au_additional", sp_dir="CASIA2/Sp_additional", retrieval="category", k=2):
+    """Return a `build_request(image_path, image_url=None)` that shares one example store across queries.
+
+    With `retrieval="similarity"` the k nearest authentic and spliced examples of
+    each target are retrieved from descriptor indexes of the two pools instead.
+    """
+    au_prompt_paths = get_all_image_paths(au_dir)
+    sp_prompt_paths = get_all_image_paths(sp_dir)
+
+    if retrieval == "similarity":
+        au_index = DescriptorIndex.build(au_prompt_paths)
+        sp_index = DescriptorIndex.build(sp_prompt_paths)
+        # Examples shared by many targets are encoded once
+        encode = functools.lru_cache(maxsize=1024)(image_data_url)
+
+        def build_similar_request(path, image_url=None):
+            au_examples, sp_examples = select_similar_examples(path, au_index, sp_index, k)
+            return build_request_with_prefix(
+                path, generate_few_shot_prompt(au_examples, sp_examples, encode), image_url)
+
+        return build_similar_request
+
+    # Encode each category's examples once and share the prefix across all queries
+    store = ExampleStore(lambda category: generate_few_shot_prompt(
+        *select_examples_for_category(category, au_prompt_paths, sp_prompt_paths)))
+
+    def build_target_request(path, image_url=None):
+        category = extract_category_from_filename(os.path.basename(path))
+        return build_request_with_prefix(path, store.prefix(category), image_url)
+
+    return build_target_request
+
 def main():
-    folder = "CASIA2/Sp_sample"
-    output_csv = "results/Sp_sample_llm_decisions_few_shot_run2.csv"
+    parser = build_arg_parser(__doc__, "CASIA2/Sp_sample", "results/Sp_sample_llm_decisions_few_shot_run2.csv")
+    parser.add_argument("--retrieval", choices=["category", "similarity"], default="category",
+                        help="Pick examples by filename category or by visual similarity to the target")
+    parser.add_argument("--k", type=int, default=2,
+                        help="Authentic and spliced examples retrieved per target in similarity mode")
+    args = parse_args(parser)
 
-    image_paths = get_all_image_paths(folder)
+    image_paths = get_all_image_paths(args.folder)
 
     # Set seed for reproducibility
     random.seed(42)
-    au_prompt_paths = get_all_image_paths("CASIA2/Au_additional")
-    sp_prompt_paths = get_all_image_paths("CASIA2/Sp_additional")
-
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-
-    with open(output_csv, mode='w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["filename", "LLM-decision"])
-
-        for path in image_paths:
-            try:
-                print(f"Processing {path}...")
-                au_examples, sp_examples = select_few_shot_examples(path, au_prompt_paths, sp_prompt_paths)
-                decision = send_image_to_openai_with_fewshot(path, au_examples, sp_examples)
-                writer.writerow([os.path.basename(path), decision])
-            except Exception as e:
-                print(f"Error processing {path}: {e}")
-                writer.writerow([os.path.basename(path), f"ERROR: {e}"])
-
-    print(f"\nProcessing complete. Results saved to: {output_csv}")
+    run_with_args(image_paths, make_request_builder(retrieval=args.retrieval, k=args.k), args)
 
 if __name__ == "__main__":
     main()
@@ -2,23 +2,24 @@
 Evaluation with Few-Shot Chain-of-Thought Prompt Strategy
 """
 
-import base64
-import csv
 import os
 from dotenv import load_dotenv
 from openai import OpenAI
+from cache import cached_create
+from example_store import ExampleStore
+from manifest import iter_image_paths
+from preprocess import image_data_url
+from runner import build_arg_parser, parse_args, run_with_args
+from scheduler import Scheduler
 
 # Load the OpenAI API key
 load_dotenv()
-client = OpenAI()
+# Retries are left to the scheduler, which paces them under the account's rate limits
+client = OpenAI(max_retries=0)
+scheduler = Scheduler()
 
 def get_all_image_paths(folder):
-    valid_extensions = ('.jpg', '.jpeg', '.png')
-    return [
-        os.path.join(folder, fname)
-        for fname in sorted(os.listdir(folder))
-        if fname.lower().endswith(valid_extensions)
-    ]
+    return sorted(iter_image_paths(folder))
 
 def get_all_text_paths(folder):
     return [
@@ -27,10 +28,6 @@ def get_all_text_paths(folder):
         if fname.lower().endswith('.txt')
     ]
 
-def encode_image_to_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
 def extract_category_from_filename(filename):
     if 'ani' in filename:
         return 'ani'
@@ -42,7 +39,8 @@ def extract_category_from_filename(filename):
         return None
 
 def match_cot_examples(category, cot_dir, img_dir):
-    cot_files = [f for f in os.listdir(cot_dir) if f.endswith('.txt') and category in f]
+    # Sorted so the example prefix is byte-identical from run to run, which provider prompt caching needs
+    cot_files = [f for f in sorted(os.listdir(cot_dir)) if f.endswith('.txt') and category in f]
     # sampled_cots = random.sample(cot_files, min(2, len(cot_files)))
     cot_examples = []
 
@@ -61,14 +59,12 @@ def generate_few_shot_prompt_with_cot(auth_examples, spliced_examples):
     messages = []
 
     for img_path, reasoning in auth_examples:
-        base64_img = encode_image_to_base64(img_path)
         messages.append({"type": "text", "text": f"For example, this image is Authentic. {reasoning}"})
-        messages.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}})
+        messages.append({"type": "image_url", "image_url": {"url": image_data_url(img_path)}})
 
     for img_path, reasoning in spliced_examples:
-        base64_img = encode_image_to_base64(img_path)
         messages.append({"type": "text", "text": f"For example, this image is Spliced. {reasoning}"})
-        messages.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}})
+        messages.append({"type": "image_url", "image_url": {"url": image_data_url(img_path)}})
 
     messages.append({"type": "text", "text":
         "Inspect the following image and identify whether it is original or has been spliced. "
@@ -78,54 +74,47 @@ def generate_few_shot_prompt_with_cot(auth_examples, spliced_examples):
 
     return messages
 
-def send_image_to_openai_with_fewshot(image_path, au_examples, sp_examples):
-    messages = generate_few_shot_prompt_with_cot(au_examples, sp_examples)
+def build_request(image_path, au_examples, sp_examples):
+    return build_request_with_prefix(image_path, generate_few_shot_prompt_with_cot(au_examples, sp_examples))
 
-    base64_image = encode_image_to_base64(image_path)
-    messages.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}})
+def build_request_with_prefix(image_path, prefix, image_url=None):
+    messages = [*prefix, {"type": "image_url", "image_url": {"url": image_url or image_data_url(image_path)}}]
 
-    response = client.chat.completions.create(
+    return dict(
         model="gpt-4.1-2025-04-14",
         messages=[{"role": "user", "content": messages}],
         temperature=0,
         max_tokens=300
     )
+
+def send_image_to_openai_with_fewshot(image_path, au_examples, sp_examples, cache=None):
+    response = cached_create(client, build_request(image_path, au_examples, sp_examples), cache, scheduler)
     result = response.choices[0].message.content.strip()
     print(result)
     return result
 
+def make_request_builder(au_img_dir="CASIA2/Au_additional", sp_img_dir="CASIA2/Sp_additional",
+                         au_cot_dir="CASIA2/Au_CoT", sp_cot_dir="CASIA2/Sp_CoT"):
+    """Return a `build_request(image_path, image_url=None)` that shares one example store across queries."""
+    # Read the reasoning files and encode the example images once per category
+    store = ExampleStore(lambda category: generate_few_shot_prompt_with_cot(
+        match_cot_examples(category, au_cot_dir, au_img_dir),
+        match_cot_examples(category, sp_cot_dir, sp_img_dir)))
+
+    def build_target_request(path, image_url=None):
+        category = extract_category_from_filename(os.path.basename(path))
+        return build_request_with_prefix(path, store.prefix(category), image_url)
+
+    return build_target_request
+
 def main():
-    folder = "CASIA2/Au_sample"
-    output_csv = "results/Au_sample_llm_decisions_fewshot_with_cot.csv"
+    args = parse_args(build_arg_parser(
+        __doc__, "CASIA2/Au_sample", "results/Au_sample_llm_decisions_fewshot_with_cot.csv"))
 
-    image_paths = get_all_image_paths(folder)
+    image_paths = get_all_image_paths(args.folder)
 
     # random.seed(42)
-    au_img_dir = "CASIA2/Au_additional"
-    sp_img_dir = "CASIA2/Sp_additional"
-    au_cot_dir = "CASIA2/Au_CoT"
-    sp_cot_dir = "CASIA2/Sp_CoT"
-
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-
-    with open(output_csv, mode='w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["filename", "LLM-decision"])
-
-        for path in image_paths:
-            try:
-                print(f"Processing {path}...")
-                category = extract_category_from_filename(os.path.basename(path))
-                au_examples = match_cot_examples(category, au_cot_dir, au_img_dir)
-                sp_examples = match_cot_examples(category, sp_cot_dir, sp_img_dir)
-                # print(au_examples, sp_examples)
-                decision = send_image_to_openai_with_fewshot(path, au_examples, sp_examples)
-                writer.writerow([os.path.basename(path), decision])
-            except Exception as e:
-                print(f"Error processing {path}: {e}")
-                writer.writerow([os.path.basename(path), f"ERROR: {e}"])
-
-    print(f"\nProcessing complete. Results saved to: {output_csv}")
+    run_with_args(image_paths, make_request_builder(), args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,215 @@
+"""
+Local forensic pre-filter: error-level, noise-residual and JPEG-grid scores that decide confident images without an API call
+"""
+
+import argparse
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from PIL import Image
+from manifest import files_key, iter_image_paths
+from metrics import RESULTS_GLOB, load_results
+
+DEFAULT_CACHE_DIR = ".cache/forensics"
+DEFAULT_CALIBRATION = ("CASIA2/Au_additional", "CASIA2/Sp_additional")
+DEFAULT_BAND = (0.1, 0.9)  # P(spliced) outside this band is decided locally
+MAX_SIDE = 1024            # larger images are cropped, never resampled, so the traces survive
+ELA_QUALITY = 90
+ELA_BLOCK = 16
+NOISE_BLOCK = 32
+GRID_TILE = 64
+GRID_MIN_STRENGTH = 0.1    # tiles whose 8-pixel grid is weaker than this have no usable phase
+FEATURES = ("ela", "noise", "grid")
+
+def _block_view(array, size):
+    """Return the array cropped to whole blocks and reshaped to (rows, size, cols, size)."""
+    rows, cols = array.shape[0] // size, array.shape[1] // size
+    return array[:rows * size, :cols * size].reshape(rows, size, cols, size)
+
+def ela_score(rgb):
+    """Error-level inconsistency: how far the worst blocks' recompression error exceeds the typical block's.
+
+    Pasted regions that went through a different compression history stand out
+    when the image is saved once more at a known quality.
+    """
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, 'JPEG', quality=ELA_QUALITY)
+    buffer.seek(0)
+    with Image.open(buffer) as resaved:
+        error = np.abs(rgb.astype(np.float32) - np.asarray(resaved, dtype=np.float32)).mean(axis=2)
+    blocks = _block_view(error, ELA_BLOCK).mean(axis=(1, 3))
+    median, high = np.percentile(blocks, [50, 99])
+    return (high - median) / (median + 1.0)
+
+def noise_score(grey):
+    """Noise-residual inconsistency: spread of the per-block noise level of a high-pass residual.
+
+    The residual is each pixel minus the mean of its four neighbours; a spliced
+    region from another camera or scale carries a different noise floor.
+    """
+    residual = grey[1:-1, 1:-1] - 0.25 * (grey[:-2, 1:-1] + grey[2:, 1:-1] + grey[1:-1, :-2] + grey[1:-1, 2:])
+    sigma = _block_view(residual, NOISE_BLOCK).std(axis=(1, 3))
+    low, high = np.percentile(np.log(sigma + 1e-3), [5, 95])
+    return high - low
+
+def _grid_phases(diff, axis):
+    """Return the per-tile phase and strength of the 8-pixel blocking grid in absolute differences along an axis."""
+    tiles = _block_view(diff, GRID_TILE)
+    # Mean difference at each offset across the tile, folded modulo the 8-pixel JPEG block
+    profile = tiles.mean(axis=1) if axis == 1 else tiles.mean(axis=3).transpose(0, 2, 1)
+    folded = profile.reshape(*profile.shape[:2], GRID_TILE // 8, 8).mean(axis=2)
+    median = np.median(folded, axis=2)
+    strength = (folded.max(axis=2) - median) / (median + 1e-3)
+    return folded.argmax(axis=2), strength, folded.sum(axis=(0, 1)).argmax()
+
+def grid_score(grey):
+    """JPEG-grid misalignment: share of tiles whose blocking grid is off the image's dominant grid.
+
+    A region pasted from another JPEG usually keeps its own 8x8 grid at a
+    different offset. Images without a visible grid score 0.
+    """
+    if min(grey.shape) < GRID_TILE + 1:
+        return 0.0
+    misaligned = strong = None
+    for axis in (0, 1):
+        diff = np.abs(np.diff(grey, axis=axis))
+        diff = diff[:, :grey.shape[1] - 1] if axis == 0 else diff[:grey.shape[0] - 1]
+        phase, strength, dominant = _grid_phases(diff, axis)
+        axis_strong = strength > GRID_MIN_STRENGTH
+        axis_misaligned = axis_strong & (phase != dominant)
+        misaligned = axis_misaligned if misaligned is None else misaligned | axis_misaligned
+        strong = axis_strong if strong is None else strong | axis_strong
+    return float(misaligned.sum() / strong.sum()) if strong.any() else 0.0
+
+def compute_features(image_path):
+    """Return the (ela, noise, grid) scores of an image."""
+    with Image.open(image_path) as image:
+        rgb = np.asarray(image.convert('RGB'))[:MAX_SIDE, :MAX_SIDE]
+    grey = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    return np.array([ela_score(rgb), noise_score(grey), grid_score(grey)], dtype=np.float32)
+
+def load_features(image_paths, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """Return the (n, 3) feature matrix of the images, computed across a process pool and cached on disk."""
+    cache_path = os.path.join(cache_dir, files_key(image_paths) + ".npy")
+    if os.path.exists(cache_path):
+        return np.load(cache_path)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        matrix = np.stack(list(pool.map(compute_features, image_paths, chunksize=16)))
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(cache_path, matrix)
+    return matrix
+
+class ForensicRouter:
+    """Logistic P(spliced) over the forensic scores, calibrated on labelled images, with a band left to the LLM."""
+
+    def __init__(self, mean, std, weights, band=DEFAULT_BAND):
+        self.mean = mean
+        self.std = std
+        self.weights = weights
+        self.band = band
+
+    @classmethod
+    def fit(cls, features, labels, band=DEFAULT_BAND, l2=1.0, iterations=25):
+        """Fit by Newton's method with an L2 penalty; `labels` are 1 for spliced images."""
+        mean, std = features.mean(axis=0), features.std(axis=0) + 1e-6
+        x = np.hstack([np.ones((len(features), 1)), (features - mean) / std])
+        weights = np.zeros(x.shape[1])
+        penalty = l2 * np.eye(x.shape[1])
+        penalty[0, 0] = 0.0  # the intercept is not shrunk
+        for _ in range(iterations):
+            p = 1.0 / (1.0 + np.exp(-x @ weights))
+            gradient = x.T @ (p - labels) + penalty @ weights
+            hessian = (x * (p * (1 - p))[:, None]).T @ x + penalty
+            weights -= np.linalg.solve(hessian, gradient)
+        return cls(mean, std, weights, band)
+
+    @classmethod
+    def calibrate(cls, folders=DEFAULT_CALIBRATION, band=DEFAULT_BAND, workers=None):
+        """Fit on the authentic and spliced example pools, which are disjoint from the evaluation samples."""
+        au_paths, sp_paths = sorted(iter_image_paths(folders[0])), sorted(iter_image_paths(folders[1]))
+        features = load_features(au_paths + sp_paths, workers=workers)
+        labels = np.r_[np.zeros(len(au_paths)), np.ones(len(sp_paths))]
+        return cls.fit(features, labels, band)
+
+    def probability(self, features):
+        """Return P(spliced) of each row of a feature matrix."""
+        x = (features - self.mean) / self.std
+        return 1.0 / (1.0 + np.exp(-(self.weights[0] + x @ self.weights[1:])))
+
+    def decide(self, probabilities):
+        """Return 'Spliced'/'Authentic' for the confident probabilities and None inside the band."""
+        low, high = self.band
+        return np.where(probabilities >= high, 'Spliced', np.where(probabilities <= low, 'Authentic', None))
+
+def route_locally(image_paths, band=DEFAULT_BAND, calibration=DEFAULT_CALIBRATION, workers=None):
+    """Return {filename: (decision, P(spliced))} for the images confident enough to skip the API."""
+    if not image_paths:
+        return {}
+    router = ForensicRouter.calibrate(calibration, band, workers)
+    probabilities = router.probability(load_features(image_paths, workers=workers))
+    local = {
+        os.path.basename(path): (decision, float(p))
+        for path, decision, p in zip(image_paths, router.decide(probabilities), probabilities) if decision
+    }
+    print(f"Forensic pre-filter: {len(local)} of {len(image_paths)} images decided locally "
+          f"({len(local) / len(image_paths):.1%} of API calls saved)")
+    return local
+
+def routing_report(df, local, band):
+    """Return, per strategy and run, the API calls saved and the accuracy with and without the pre-filter."""
+    routed = df.copy()
+    local_pred = routed['filename'].map(lambda name: local[name][0].lower() if name in local else None)
+    routed['routed_pred'] = local_pred.fillna(routed['pred'])
+    routed['local'] = local_pred.notna()
+    routed['llm_correct'] = routed['pred'] == routed['truth']
+    routed['routed_correct'] = routed['routed_pred'] == routed['truth']
+    table = routed.groupby(['strategy', 'run']).agg(
+        images=('filename', 'size'),
+        calls_saved=('local', 'mean'),
+        llm_accuracy=('llm_correct', 'mean'),
+        routed_accuracy=('routed_correct', 'mean'),
+    )
+    table['accuracy_change'] = table['routed_accuracy'] - table['llm_accuracy']
+    local_rows = routed[routed['local']]
+    table['local_accuracy'] = (local_rows['routed_pred'] == local_rows['truth']).groupby(
+        [local_rows['strategy'], local_rows['run']]).mean()
+    table.insert(0, 'band', f"{band[0]:g}-{band[1]:g}")
+    return table
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the API calls the forensic pre-filter saves and its accuracy change on existing results")
+    parser.add_argument("--results", default=RESULTS_GLOB, help="Glob of the LLM results CSVs (or a results store)")
+    parser.add_argument("--folders", nargs="+", default=["CASIA2/Au_sample", "CASIA2/Sp_sample"],
+                        help="Folders of the evaluated images")
+    parser.add_argument("--calibration", nargs=2, default=DEFAULT_CALIBRATION, metavar=("AU_DIR", "SP_DIR"),
+                        help="Labelled authentic and spliced folders the router is calibrated on")
+    parser.add_argument("--bands", nargs="+", type=float, default=[0.05, 0.1, 0.2, 0.3],
+                        help="Lower edges of the bands to compare; each band is symmetric, e.g. 0.1 is 0.1-0.9")
+    parser.add_argument("--workers", type=int, help="Processes computing the forensic scores")
+    args = parser.parse_args()
+
+    image_paths = [path for folder in args.folders for path in sorted(iter_image_paths(folder))]
+    router = ForensicRouter.calibrate(args.calibration, workers=args.workers)
+    probabilities = router.probability(load_features(image_paths, workers=args.workers))
+    print("Calibrated weights (intercept, " + ", ".join(FEATURES) + "): "
+          + ", ".join(f"{weight:.3f}" for weight in router.weights))
+
+    df = load_results(args.results)
+    df = df[df['filename'].isin({os.path.basename(path) for path in image_paths})]
+    tables = []
+    for low in args.bands:
+        router.band = (low, 1.0 - low)
+        local = {os.path.basename(path): (decision, p)
+                 for path, decision, p in zip(image_paths, router.decide(probabilities), probabilities) if decision}
+        tables.append(routing_report(df, local, router.band))
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200,
+                           'display.precision', 4):
+        print(pd.concat(tables).reset_index().set_index(['strategy', 'run', 'band']).sort_index())
+
+if __name__ == "__main__":
+    main()
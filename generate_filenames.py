@@ -1,22 +1,26 @@
 import os
+from manifest import DEFAULT_MANIFEST_PATH, load_subset, open_manifest, write_filename_list
 
 def main():
     # Define the base directory and subdirectories
     base_dir = 'CASIA2'
     subdirs = ['Au_additional', 'Au_sample', 'Sp_additional', 'Sp_sample']
 
-    # Function to collect filenames and write to corresponding text files
+    conn = open_manifest(DEFAULT_MANIFEST_PATH)
+
+    # Write each subset recorded in the manifest to its text file, falling back to a directory listing
     for subdir in subdirs:
         dir_path = os.path.join(base_dir, subdir)
         output_file_path = os.path.join(base_dir, f'{subdir}.txt')
 
-        if os.path.exists(dir_path):
-            with open(output_file_path, 'w') as f_out:
-                for filename in os.listdir(dir_path):
-                    if os.path.isfile(os.path.join(dir_path, filename)):
-                        f_out.write(f"{filename}\n")
+        _, filenames = load_subset(conn, subdir)
+        if not filenames and os.path.exists(dir_path):
+            filenames = [entry.name for entry in os.scandir(dir_path) if entry.is_file()]
+
+        if filenames:
+            write_filename_list(filenames, output_file_path)
 
-    output_file_paths = [os.path.join(base_dir, f'{subdir}.txt') for subdir in subdirs]
+    conn.close()
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
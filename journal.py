@@ -0,0 +1,120 @@
+"""
+Append-only journal of decisions used to resume interrupted runs
+"""
+
+import csv
+import json
+import os
+
+JOURNAL_SUFFIX = ".journal.jsonl"
+
+def journal_path(output_csv):
+    """Return the journal file kept next to a results CSV."""
+    return output_csv + JOURNAL_SUFFIX
+
+def is_error(decision):
+    """Return True for decisions recorded from a failed request."""
+    return decision is None or decision.startswith("ERROR")
+
+class Journal:
+    """Append-only JSONL log with one fsync'd line per decided image."""
+
+    def __init__(self, path):
+        self.path = path
+        journal_dir = os.path.dirname(path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+        self._file = open(path, 'a+', encoding='utf-8')
+
+        # Terminate a line torn by a crash so the next record starts cleanly
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() > 0:
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+
+    def record(self, filename, decision, score=None, samples=None):
+        """Append one decision (with its P(spliced) score and sampled answers, if any) and force it to disk."""
+        entry = {"filename": filename, "decision": decision}
+        if score is not None:
+            entry["score"] = score
+        if samples is not None:
+            entry["samples"] = samples
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+def _read_entries(path):
+    """Yield the journal entries in order, skipping lines torn by a crash."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def read_journal(path):
+    """Return the latest decision per filename."""
+    return {entry["filename"]: entry["decision"] for entry in _read_entries(path)}
+
+def read_journal_scores(path):
+    """Return the P(spliced) score of the latest decision per filename, for those that have one."""
+    scores = {}
+    for entry in _read_entries(path):
+        if entry.get("score") is None:
+            scores.pop(entry["filename"], None)
+        else:
+            scores[entry["filename"]] = entry["score"]
+    return scores
+
+def read_journal_samples(path):
+    """Return the sampled answers of the latest decision per filename, for those decided by a vote."""
+    samples = {}
+    for entry in _read_entries(path):
+        if entry.get("samples") is None:
+            samples.pop(entry["filename"], None)
+        else:
+            samples[entry["filename"]] = entry["samples"]
+    return samples
+
+def read_results_csv(path):
+    """Return the filename to decision mapping of an existing results CSV."""
+    decisions = {}
+    with open(path, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 2:
+                decisions[row[0]] = row[1]
+    return decisions
+
+def write_results_csv(output_csv, decisions, filenames, scores=None, columns=None):
+    """Atomically rewrite the canonical CSV with the decided filenames in the given order.
+
+    When any decision has a P(spliced) score an `LLM-score` column is added.
+    `columns` maps the names of further columns to their values per filename.
+    """
+    output_dir = os.path.dirname(output_csv)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    columns = columns or {}
+    tmp_path = output_csv + ".tmp"
+    with open(tmp_path, mode='w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["filename", "LLM-decision"] + (["LLM-score"] if scores else []) + list(columns))
+        for filename in filenames:
+            if filename not in decisions:
+                continue
+            row = [filename, decisions[filename]]
+            if scores:
+                score = scores.get(filename)
+                row.append("" if score is None else f"{score:.6f}")
+            row.extend(values.get(filename, "") for values in columns.values())
+            writer.writerow(row)
+    os.replace(tmp_path, output_csv)
@@ -0,0 +1,235 @@
+"""
+Manifest index of the CASIA v2.0 images and zero-copy views of dataset subsets
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+DEFAULT_MANIFEST_PATH = "CASIA2/manifest.sqlite"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+POOL_SUFFIX = "_pool"  # subset holding a sample as drawn, before examples are carved out of it
+
+AUTHENTIC_PATTERN = re.compile(r"^Au_(\w+)_\d+\.\w+$", re.IGNORECASE)
+# Tp_<D|S>_XXX_X_X_<src_category><id>_<dst_category><id>_<id>.ext
+SPLICED_PATTERN = re.compile(
+    r"^Tp_([DS])_[^_]+_[^_]+_[^_]+_([a-zA-Z]+)\d+_([a-zA-Z]+)\d+_\d+\.\w+$",
+    re.IGNORECASE
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    label TEXT,
+    category TEXT,
+    splice_type TEXT,
+    src_category TEXT,
+    dst_category TEXT,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (folder, filename)
+);
+CREATE INDEX IF NOT EXISTS images_label_category ON images (folder, label, category);
+CREATE TABLE IF NOT EXISTS subsets (
+    name TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (name, filename)
+);
+"""
+
+def open_manifest(path=DEFAULT_MANIFEST_PATH):
+    """Open (creating if needed) the manifest database."""
+    manifest_dir = os.path.dirname(path)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+def parse_filename(filename):
+    """Return (label, category, splice_type, src_category, dst_category) parsed from a CASIA filename."""
+    match = AUTHENTIC_PATTERN.match(filename)
+    if match:
+        return 'authentic', match.group(1).lower(), None, None, None
+    match = SPLICED_PATTERN.match(filename)
+    if match:
+        return 'spliced', None, match.group(1).upper(), match.group(2).lower(), match.group(3).lower()
+    return None, None, None, None, None
+
+def iter_image_paths(folder):
+    """Yield the image file paths in the folder as `os.scandir` finds them, without listing it first."""
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                yield entry.path
+
+def files_key(paths):
+    """Return a cache key of the files at the paths, from their path, size and modification time."""
+    key = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        key.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return key.hexdigest()
+
+def _describe(path):
+    """Return the content hash and pixel dimensions of one image, reading only its header for the size."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+    except OSError:
+        width = height = None
+    return digest.hexdigest(), width, height
+
+def index_folder(conn, folder, workers=8):
+    """Add or refresh the manifest rows of a folder; unchanged files (same size and mtime) are skipped."""
+    known = {
+        filename: (size, mtime)
+        for filename, size, mtime in conn.execute(
+            "SELECT filename, size, mtime FROM images WHERE folder = ?", (folder,))
+    }
+
+    entries = []
+    present = set()
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                continue
+            present.add(entry.name)
+            stat = entry.stat()
+            if known.get(entry.name) != (stat.st_size, stat.st_mtime):
+                entries.append((entry.name, entry.path, stat.st_size, stat.st_mtime))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        descriptions = pool.map(_describe, [path for _, path, _, _ in entries])
+        rows = [
+            (folder, name, os.path.splitext(name)[1].lower(), *parse_filename(name), size, mtime, *description)
+            for (name, _, size, mtime), description in zip(entries, descriptions)
+        ]
+    conn.executemany(
+        "INSERT OR REPLACE INTO images (folder, filename, extension, label, category, splice_type, "
+        "src_category, dst_category, size, mtime, sha256, width, height) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+    removed = [(folder, name) for name in known if name not in present]
+    conn.executemany("DELETE FROM images WHERE folder = ? AND filename = ?", removed)
+    conn.commit()
+    print(f"Indexed {folder}: {len(rows)} new or changed, {len(removed)} removed, {len(present)} total")
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+def category_counts(conn, folder, extensions=IMAGE_EXTENSIONS):
+    """Return (category, count) of the authentic images of a folder, most common first."""
+    return conn.execute(
+        f"SELECT category, COUNT(*) AS n FROM images WHERE folder = ? AND label = 'authentic' "
+        f"AND extension IN ({_placeholders(extensions)}) GROUP BY category ORDER BY n DESC, MIN(rowid)",
+        (folder, *extensions)
+    ).fetchall()
+
+def select_authentic(conn, folder, categories, extensions=IMAGE_EXTENSIONS):
+    """Return the sorted filenames of authentic images in any of the categories."""
+    rows = conn.execute(
+        f"SELECT filename FROM images WHERE folder = ? AND label = 'authentic' "
+        f"AND category IN ({_placeholders(categories)}) AND extension IN ({_placeholders(extensions)}) "
+        f"ORDER BY filename",
+        (folder, *categories, *extensions)
+    )
+    return [filename for filename, in rows]
+
+def select_spliced(conn, folder, categories, splice_type='D', extensions=IMAGE_EXTENSIONS):
+    """Return the sorted filenames of spliced images whose source or destination is in the categories."""
+    rows = conn.execute(
+        f"SELECT filename FROM images WHERE folder = ? AND label = 'spliced' AND splice_type = ? "
+        f"AND (src_category IN ({_placeholders(categories)}) OR dst_category IN ({_placeholders(categories)})) "
+        f"AND extension IN ({_placeholders(extensions)}) ORDER BY filename",
+        (folder, splice_type, *categories, *categories, *extensions)
+    )
+    return [filename for filename, in rows]
+
+def save_subset(conn, name, folder, filenames):
+    """Store (replacing) a named subset of a folder's images."""
+    conn.execute("DELETE FROM subsets WHERE name = ?", (name,))
+    conn.executemany(
+        "INSERT INTO subsets (name, folder, filename) VALUES (?, ?, ?)",
+        [(name, folder, filename) for filename in filenames]
+    )
+    conn.commit()
+
+def pool_name(name):
+    """Return the subset name of a sample's full pool, kept before examples are carved out of the sample."""
+    return f"{name}{POOL_SUFFIX}"
+
+def load_subset(conn, name):
+    """Return the source folder and sorted filenames of a named subset (folder is None if unknown)."""
+    rows = conn.execute("SELECT folder, filename FROM subsets WHERE name = ? ORDER BY filename", (name,)).fetchall()
+    if not rows:
+        return None, []
+    return rows[0][0], [filename for _, filename in rows]
+
+def materialize_view(source_dir, filenames, output_dir, mode='symlink'):
+    """Make `output_dir` expose exactly the given files of `source_dir` as symlinks or hardlinks.
+
+    Links that are no longer part of the view are removed; regular files left by
+    an earlier copy-based sampling are never deleted.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    wanted = set(filenames)
+
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            if entry.name in wanted or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            source = os.path.join(source_dir, entry.name)
+            if entry.is_symlink() or (os.path.exists(source) and os.path.samefile(entry.path, source)):
+                os.remove(entry.path)
+            else:
+                print(f"Leaving {entry.path} in place: not a link into {source_dir}")
+
+    for filename in wanted:
+        dst = os.path.join(output_dir, filename)
+        if os.path.lexists(dst):
+            continue
+        src = os.path.join(source_dir, filename)
+        if mode == 'hardlink':
+            os.link(src, dst)
+        else:
+            os.symlink(os.path.relpath(src, output_dir), dst)
+
+    print(f"View {output_dir}: {len(wanted)} images linked from {source_dir}")
+
+def write_filename_list(filenames, output_file):
+    """Write one filename per line, the format of the dataset/*.txt lists."""
+    with open(output_file, 'w') as f_out:
+        for filename in filenames:
+            f_out.write(f"{filename}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the CASIA v2.0 manifest index")
+    parser.add_argument("folders", nargs="*", default=["CASIA2/Au", "CASIA2/Tp"])
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    conn = open_manifest(args.manifest)
+    for folder in args.folders:
+        index_folder(conn, folder, args.workers)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Unified detection metrics over every results CSV, computed in a single vectorized pass
+"""
+
+import argparse
+import glob
+import os
+import re
+import numpy as np
+import pandas as pd
+from manifest import AUTHENTIC_PATTERN, SPLICED_PATTERN
+from results_store import BASE_RUN, RUN_PATTERN, ResultsStore, read_decisions
+from verdict import parse_decision
+
+RESULTS_GLOB = "results/*_llm_decisions_*.csv"
+STORE_SUFFIX = ".sqlite"
+
+def normalize_decisions(decisions):
+    """Map raw decision strings to 'authentic', 'spliced' or 'invalid' with the robust verdict parser.
+
+    Each distinct answer is parsed once, so free-text explanations cost no more than bare labels.
+    """
+    parsed = {decision: parse_decision(decision) or 'invalid' for decision in decisions.unique()}
+    return decisions.map(parsed)
+
+def read_store(path, strategies=None, run_ids=None):
+    """Load the decisions of a results store in the layout of the CSV-based frame."""
+    store = ResultsStore(path)
+    df = store.read(strategies, run_ids)
+    store.close()
+    if df.empty:
+        raise FileNotFoundError(f"No decisions stored in {path}")
+    # A run repeated with a changed prompt keeps only the latest decision per image
+    df = (df.sort_values('recorded_at').drop_duplicates(['strategy', 'run_id', 'filename'], keep='last')
+          .rename(columns={'run_id': 'run', 'source': 'file'}))
+    df['decision'] = df['decision'].fillna("")
+    df['score'] = df['score'].astype(float)
+    df['split'] = df['split'].fillna(pd.Series(np.where(df['filename'].str.startswith('Tp_'), 'Sp', 'Au'),
+                                               index=df.index))
+    return df[['filename', 'decision', 'score', 'raw_text', 'file', 'split', 'strategy', 'run']]
+
+def load_results(pattern=RESULTS_GLOB):
+    """Load every results CSV (or a results store) into one long frame with run metadata and ground truth."""
+    if pattern.endswith(STORE_SUFFIX):
+        df = read_store(pattern)
+    else:
+        frames = []
+        for path in sorted(glob.glob(pattern)):
+            match = RUN_PATTERN.match(os.path.splitext(os.path.basename(path))[0])
+            if not match:
+                continue
+            frame = pd.DataFrame(read_decisions(path), columns=['filename', 'decision', 'score', 'raw_text'])
+            frame['file'] = os.path.basename(path)
+            frame['split'] = match.group('split')
+            frame['strategy'] = match.group('strategy')
+            frame['run'] = match.group('run') or BASE_RUN
+            frames.append(frame)
+        if not frames:
+            raise FileNotFoundError(f"No results files match {pattern}")
+        df = pd.concat(frames, ignore_index=True)
+    df['pred'] = normalize_decisions(df['decision'])
+    df['truth'] = np.where(df['filename'].str.startswith('Tp_'), 'spliced', 'authentic')
+    df['category'] = df['filename'].str.extract(AUTHENTIC_PATTERN.pattern, flags=re.IGNORECASE)[0].str.lower()
+    pairs = df['filename'].str.extract(SPLICED_PATTERN.pattern, flags=re.IGNORECASE)
+    df['src_category'] = pairs[1].str.lower()
+    df['dst_category'] = pairs[2].str.lower()
+    return df
+
+def pair_runs(df):
+    """Attach each (strategy, run) to both splits, reusing the other split's base run when it has no such run.
+
+    For example Sp `few_shot_run1` is evaluated together with Au `few_shot`.
+    """
+    runs = df[['split', 'strategy', 'run']].drop_duplicates()
+    available = set(map(tuple, runs.to_numpy()))
+    keys = runs[['strategy', 'run']].drop_duplicates()
+
+    paired = []
+    for split in ('Au', 'Sp'):
+        # Source run of this split for every (strategy, run) key
+        source = keys.copy()
+        source['split'] = split
+        exact = [(split, s, r) in available for s, r in keys.to_numpy()]
+        base = [(split, s, BASE_RUN) in available for s, r in keys.to_numpy()]
+        source['source_run'] = np.where(exact, keys['run'], np.where(base, BASE_RUN, None))
+        source = source.dropna(subset=['source_run'])
+        rows = df[df['split'] == split].merge(
+            source, left_on=['split', 'strategy', 'run'], right_on=['split', 'strategy', 'source_run'],
+            suffixes=('_source', ''))
+        paired.append(rows.drop(columns=['run_source', 'source_run']))
+    return pd.concat(paired, ignore_index=True)
+
+def confusion_metrics(df, keys):
+    """Return confusion counts and derived metrics per group; 'spliced' is the positive class.
+
+    Invalid (unparseable) answers are counted separately and left out of the confusion matrix.
+    """
+    valid = df['pred'] != 'invalid'
+    pred_sp = df['pred'] == 'spliced'
+    true_sp = df['truth'] == 'spliced'
+    counts = pd.DataFrame({
+        'tp': valid & pred_sp & true_sp,
+        'fp': valid & pred_sp & ~true_sp,
+        'tn': valid & ~pred_sp & ~true_sp,
+        'fn': valid & ~pred_sp & true_sp,
+        'invalid': ~valid,
+    }).astype(int)
+    table = pd.concat([df[keys], counts], axis=1).groupby(keys, dropna=False).sum()
+
+    tp, fp, tn, fn = (table[c].to_numpy(dtype=float) for c in ('tp', 'fp', 'tn', 'fn'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = tp / (tp + fp)
+        recall = tp / (tp + fn)
+        specificity = tn / (tn + fp)
+        table['accuracy'] = (tp + tn) / (tp + fp + tn + fn)
+        table['precision'] = precision
+        table['recall'] = recall
+        table['specificity'] = specificity
+        table['f1'] = 2 * precision * recall / (precision + recall)
+        table['balanced_accuracy'] = (recall + specificity) / 2
+    if df['score'].notna().any():
+        table['auc'] = roc_auc(df, keys)
+    return table
+
+def roc_auc(df, keys):
+    """Return the ROC AUC of the P(spliced) scores per group (Mann-Whitney rank statistic over scored rows)."""
+    scored = df[df['score'].notna()].copy()
+    scored['positive'] = scored['truth'] == 'spliced'
+    scored['rank'] = scored.groupby(keys, dropna=False)['score'].rank(method='average')
+    scored['positive_rank'] = scored['rank'].where(scored['positive'], 0.0)
+    sums = scored.groupby(keys, dropna=False).agg(
+        n=('positive', 'size'), n_pos=('positive', 'sum'), rank_sum=('positive_rank', 'sum'))
+    n_neg = sums['n'] - sums['n_pos']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (sums['rank_sum'] - sums['n_pos'] * (sums['n_pos'] + 1) / 2) / (sums['n_pos'] * n_neg)
+
+def category_memberships(df):
+    """Return one row per (image, category) it involves: its own category, or source and destination."""
+    authentic = df[df['truth'] == 'authentic'].assign(category_group=lambda x: x['category'])
+    src = df[df['truth'] == 'spliced'].assign(category_group=lambda x: x['src_category'])
+    dst = df[(df['truth'] == 'spliced') & (df['dst_category'] != df['src_category'])].assign(
+        category_group=lambda x: x['dst_category'])
+    return pd.concat([authentic, src, dst], ignore_index=True)
+
+def compare(df):
+    """Return the overall, per-category and per-(source, destination) tables across all strategies and runs."""
+    paired = pair_runs(df)
+    overall = confusion_metrics(paired, ['strategy', 'run'])
+    by_category = confusion_metrics(category_memberships(paired), ['strategy', 'run', 'category_group'])
+    spliced = paired[paired['truth'] == 'spliced']
+    by_pair = confusion_metrics(spliced, ['strategy', 'run', 'src_category', 'dst_category'])
+    return overall, by_category, by_pair[['tp', 'fn', 'invalid', 'recall']]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare every strategy and run in the results folder")
+    parser.add_argument("--results", default=RESULTS_GLOB,
+                        help="Glob of the results CSVs to load, or a results store (.sqlite)")
+    parser.add_argument("--by", choices=["overall", "category", "pair"], default="overall",
+                        help="Breakdown to print")
+    parser.add_argument("--csv", help="Also write the printed table to this CSV")
+    args = parser.parse_args()
+
+    overall, by_category, by_pair = compare(load_results(args.results))
+    table = {"overall": overall, "category": by_category, "pair": by_pair}[args.by]
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200,
+                           'display.precision', 4):
+        print(table)
+    if args.csv:
+        table.to_csv(args.csv)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Packed requests: several target images after one shared prompt prefix, answered as a JSON array of verdicts
+"""
+
+import json
+from results_store import prompt_hash
+from verdict import parse_decision
+
+PACKED_INSTRUCTION = (
+    "Answer for each of the {count} numbered images above separately, using the index of its 'Image N:' label. "
+    "For each image, give brief reasoning and then the verdict 'Authentic' for an unedited image or 'Spliced' "
+    "for a manipulated one."
+)
+PACKED_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "packed_verdicts",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "verdicts": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "index": {"type": "integer"},
+                            "reasoning": {"type": "string"},
+                            "verdict": {"type": "string", "enum": ["Authentic", "Spliced"]},
+                        },
+                        "required": ["index", "reasoning", "verdict"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["verdicts"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def _target_index(content):
+    """Return the position of the target (last) image part of a message's content."""
+    return max(i for i, part in enumerate(content) if part["type"] == "image_url")
+
+def pack_key(request):
+    """Return the key of the requests that can share a pack: identical except for their target image."""
+    return prompt_hash(request)
+
+def pack_requests(requests):
+    """Return one request asking about the target images of several requests sharing a prompt prefix.
+
+    The prefix (examples and task text) is sent once, followed by each target
+    image under an "Image N:" label, and the answer is constrained to a JSON
+    array of per-image verdicts. Each image keeps its own output token budget.
+    """
+    first = requests[0]
+    content = first["messages"][-1]["content"]
+    parts = list(content[:_target_index(content)])
+    for index, request in enumerate(requests, start=1):
+        target_content = request["messages"][-1]["content"]
+        parts.append({"type": "text", "text": f"Image {index}:"})
+        parts.append(target_content[_target_index(target_content)])
+    parts.append({"type": "text", "text": PACKED_INSTRUCTION.format(count=len(requests))})
+
+    messages = first["messages"][:-1] + [dict(first["messages"][-1], content=parts)]
+    return dict(first, messages=messages, response_format=PACKED_SCHEMA,
+                max_tokens=sum(request.get("max_tokens") or 0 for request in requests) or None)
+
+def parse_packed(text, count):
+    """Return {index: (label, reasoning)} for the valid entries of a packed answer, with 1-based indices.
+
+    Entries that are malformed, out of range, unparseable or given twice are
+    left out, so the caller can resubmit those images on their own.
+    """
+    try:
+        entries = json.loads(text)["verdicts"]
+    except (TypeError, ValueError, KeyError):
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    answers, repeated = {}, set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get("index")
+        label = parse_decision(entry.get("verdict"))
+        if not isinstance(index, int) or not 1 <= index <= count or label is None:
+            continue
+        if index in answers:
+            repeated.add(index)
+        answers[index] = (label, entry.get("reasoning") or "")
+    for index in repeated:
+        del answers[index]
+    return answers
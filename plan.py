@@ -0,0 +1,144 @@
+"""
+Pre-flight plan of a run: expected tokens, cost and runtime from image headers only, without calling the API
+"""
+
+import argparse
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from PIL import Image
+import preprocess
+from evaluate import STRATEGIES
+from manifest import iter_image_paths
+from runner import DEFAULT_CONCURRENCY
+from telemetry import PRICES_PER_MILLION, TRACE_GLOB, load_traces, request_cost
+from tokens import estimate_request_tokens, image_tokens
+
+TARGET_URL = "plan:target"  # stands in for the target's data URL, so no target image is encoded
+DEFAULT_LATENCY = 3.0       # seconds per request when no traces of the strategy exist
+HEADER_WORKERS = 16
+
+def image_size(image_path):
+    """Return the (width, height) of an image from its header, without decoding the pixels."""
+    with Image.open(image_path) as image:
+        return image.size
+
+def prefix_tokens(request):
+    """Return the estimated prompt tokens of a request apart from its target (last) image."""
+    message = request["messages"][-1]
+    content = message["content"]
+    target = max(i for i, part in enumerate(content) if part["type"] == "image_url")
+    stripped = dict(message, content=content[:target] + content[target + 1:])
+    return estimate_request_tokens({"messages": request["messages"][:-1] + [stripped]})
+
+def plan_requests(image_paths, sizes, build_request):
+    """Return one row per image with the model, prompt tokens and output token budget of its request.
+
+    The request is built exactly as the strategy builds it, examples included,
+    with a placeholder for the target image, whose tokens come from its size.
+    Images the strategy cannot build a request for, such as few-shot targets of a
+    category without examples, get an empty row; a run records them as errors.
+    """
+    rows = []
+    for path, (width, height) in zip(image_paths, sizes):
+        try:
+            request = build_request(path, TARGET_URL)
+        except Exception:
+            rows.append((None, 0, 0))
+            continue
+        rows.append((request["model"], prefix_tokens(request) + image_tokens(width, height),
+                     (request.get("max_tokens") or 0) * (request.get("n") or 1)))
+    return pd.DataFrame(rows, columns=["model", "prompt_tokens", "max_output_tokens"])
+
+def trace_history(pattern=TRACE_GLOB):
+    """Return the completion tokens per answered image and the median latency of each strategy's past requests."""
+    try:
+        df = load_traces(pattern)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=["output_tokens", "latency_s"])
+    df = df[df['error'].isna()]
+    network = df[~df['cache_hit'].astype(bool) & df['latency_s'].notna()]
+    # Totals rather than a mean of ratios: a pack that answered no image still spent its completion tokens
+    totals = df.groupby('strategy')[['completion_tokens', 'images']].sum()
+    return pd.DataFrame({
+        "output_tokens": totals['completion_tokens'] / totals['images'].where(totals['images'] > 0),
+        "latency_s": network.groupby('strategy')['latency_s'].median(),
+    })
+
+def plan_row(strategy, requests, history, concurrency, rpm=None, tpm=None):
+    """Return the expected tokens, cost and runtime of one strategy over the planned requests.
+
+    Output tokens are the mean of the strategy's traced requests, or the full
+    `max_tokens` budget without traces. The runtime is the slowest of the requests
+    in flight at `concurrency` and, when given, the requests- and tokens-per-minute
+    limits. Prompt cache discounts are not counted, so the cost is an upper bound
+    on the input side.
+    """
+    unbuildable = int(requests["model"].isna().sum())
+    requests = requests.dropna(subset=["model"])
+    if requests.empty:
+        return {"strategy": strategy, "images": unbuildable, "unbuildable": unbuildable}
+    traced = history.loc[strategy] if strategy in history.index else None
+    output = traced["output_tokens"] if traced is not None else np.nan
+    latency = traced["latency_s"] if traced is not None and not np.isnan(traced["latency_s"]) else DEFAULT_LATENCY
+
+    model = requests["model"].iloc[0]
+    prompt = int(requests["prompt_tokens"].sum())
+    completion = int(requests["max_output_tokens"].sum() if np.isnan(output) else round(output * len(requests)))
+    runtime = len(requests) * latency / concurrency
+    if rpm:
+        runtime = max(runtime, len(requests) / rpm * 60)
+    if tpm:
+        runtime = max(runtime, (prompt + requests["max_output_tokens"].sum()) / tpm * 60)
+    cost = request_cost(model, prompt, 0, completion)
+    return {
+        "strategy": strategy, "model": model, "images": len(requests) + unbuildable, "unbuildable": unbuildable,
+        "prompt_tokens": prompt, "prompt_tokens_per_image": prompt / len(requests),
+        "output_tokens": completion, "output_source": "max_tokens" if np.isnan(output) else "traces",
+        "cost_usd": np.nan if cost is None else cost,
+        "cost_per_1k_images": np.nan if cost is None else cost / len(requests) * 1000,
+        "latency_s": latency, "runtime_min": runtime / 60,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Estimate the tokens, cost and runtime of a run from image headers, without calling the API")
+    parser.add_argument("--folders", nargs="+", default=["CASIA2/Au", "CASIA2/Tp"],
+                        help="Folders of the images to plan for")
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES),
+                        help="Strategies to plan")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Requests in flight at once in the planned run")
+    parser.add_argument("--rpm", type=int, help="Requests-per-minute limit of the account")
+    parser.add_argument("--tpm", type=int, help="Tokens-per-minute limit of the account")
+    parser.add_argument("--traces", default=TRACE_GLOB,
+                        help="Glob of past traces the output tokens and latency per request are taken from")
+    parser.add_argument("--no-preprocess", action="store_true",
+                        help="Plan for sending the original example files, as the runners' --no-preprocess")
+    args = parser.parse_args()
+
+    # The example images are encoded once, as a run would; target images are only opened for their size
+    preprocess.configure(not args.no_preprocess)
+    image_paths = [path for folder in args.folders for path in sorted(iter_image_paths(folder))]
+    with ThreadPoolExecutor(HEADER_WORKERS) as pool:
+        sizes = list(pool.map(image_size, image_paths, chunksize=64))
+    print(f"{len(image_paths)} images, {sum(math.prod(size) for size in sizes) / 1e6:.1f} megapixels in total")
+
+    history = trace_history(args.traces)
+    rows = [plan_row(strategy, plan_requests(image_paths, sizes, STRATEGIES[strategy]()), history,
+                     args.concurrency, args.rpm, args.tpm)
+            for strategy in args.strategies]
+    table = pd.DataFrame(rows).set_index("strategy")
+    unpriced = sorted(set(table["model"].dropna()) - set(PRICES_PER_MILLION))
+    if unpriced:
+        print(f"No price known for {', '.join(unpriced)}; their cost is left empty")
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 250,
+                           'display.precision', 4):
+        print(table)
+    if table["unbuildable"].any():
+        print("\nUnbuildable images get no request: the strategy has no prompt for them and records them as errors")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Image preprocessing in front of the base64 encoding: downscaling, re-encoding and a disk cache
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from PIL import Image
+
+# The vision tiler fits images inside 2048x2048 and then scales the short side to 768,
+# so pixels beyond that are uploaded and billed without being used
+DEFAULT_OPTIONS = {
+    "max_side": 2048,
+    "short_side": 768,
+    "max_bytes": None,
+    "quality": 90,
+}
+DEFAULT_CACHE_DIR = ".cache/images"
+
+# Formats the API accepts; other sources (BMP, TIFF) are converted to PNG even with preprocessing off
+MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+}
+
+# Preprocessing options of this run (None sends the original files) and the images already prepared
+_options = None
+_prepared = {}
+
+def encode_image_to_base64(image_path):
+    """Encode an image file to base64 string."""
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+def mime_type(image_path):
+    """Return the MIME type matching an image's extension."""
+    return MIME_TYPES.get(os.path.splitext(image_path)[1].lower(), 'image/jpeg')
+
+def encode_png_to_base64(image_path):
+    """Convert an image losslessly to PNG and return it as a base64 string."""
+    buffer = io.BytesIO()
+    with Image.open(image_path) as image:
+        if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+def _target_size(width, height, max_side, short_side):
+    scale = min(1.0, max_side / max(width, height), short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def preprocess_image(image_path, max_side=2048, short_side=768, max_bytes=None, quality=90,
+                     cache_dir=DEFAULT_CACHE_DIR):
+    """Return the path of the image as sent: the source or a cached copy that fits the size and byte budget.
+
+    JPEG sources that already fit are sent as they are, since re-encoding would
+    overwrite the compression traces splicing leaves behind. Everything else is
+    downscaled and re-encoded as JPEG, lowering quality and then size until it
+    fits `max_bytes`. The cache key is the source hash plus the options.
+    """
+    with open(image_path, 'rb') as f:
+        data = f.read()
+
+    image = Image.open(io.BytesIO(data))
+    size = _target_size(image.width, image.height, max_side, short_side)
+    if image.format == 'JPEG' and size == image.size and (max_bytes is None or len(data) <= max_bytes):
+        return image_path
+
+    params = json.dumps([max_side, short_side, max_bytes, quality]).encode('utf-8')
+    key = hashlib.sha256(data + params).hexdigest()
+    output_path = os.path.join(cache_dir, key[:2], key + ".jpg")
+    if os.path.exists(output_path):
+        return output_path
+
+    image = image.convert('RGB')
+    while True:
+        resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+        for q in range(quality, 49, -10):
+            buffer = io.BytesIO()
+            resized.save(buffer, format='JPEG', quality=q)
+            encoded = buffer.getvalue()
+            if max_bytes is None or len(encoded) <= max_bytes:
+                break
+        if max_bytes is None or len(encoded) <= max_bytes or min(size) <= 64:
+            break
+        size = (max(1, int(size[0] * 0.8)), max(1, int(size[1] * 0.8)))
+
+    # Write atomically so concurrent workers never see a partial file
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(encoded)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def preprocess_images(image_paths, workers=None, **options):
+    """Preprocess the images across a process pool and return the source to cached path mapping."""
+    image_paths = list(image_paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        prepared = pool.map(partial(preprocess_image, **options), image_paths, chunksize=16)
+        return dict(zip(image_paths, prepared))
+
+def configure(enabled=True, **options):
+    """Turn preprocessing on with the given options, or off to send the original files."""
+    global _options
+    _options = dict(DEFAULT_OPTIONS, **options) if enabled else None
+    _prepared.clear()
+
+def prepare(image_paths, workers=None):
+    """Warm the preprocessing cache for a run's images in parallel."""
+    if _options is not None:
+        _prepared.update(preprocess_images(image_paths, workers, **_options))
+
+def start_pool(workers=None):
+    """Return a process pool preprocessing a run's images as they are read, or None when preprocessing is off."""
+    return ProcessPoolExecutor(max_workers=workers) if _options is not None else None
+
+async def prepare_async(image_path, pool):
+    """Preprocess one image in the pool without blocking the event loop.
+
+    Failures are left to `image_data_url`, which raises them for that image alone.
+    """
+    if pool is None or image_path in _prepared:
+        return
+    try:
+        _prepared[image_path] = await asyncio.get_running_loop().run_in_executor(
+            pool, partial(preprocess_image, image_path, **_options))
+    except Exception:
+        pass
+
+def image_data_url(image_path):
+    """Return the base64 data URL sent for an image, preprocessed when enabled."""
+    if _options is not None:
+        image_path = _prepared.get(image_path) or preprocess_image(image_path, **_options)
+    if os.path.splitext(image_path)[1].lower() not in MIME_TYPES:
+        return f"data:image/png;base64,{encode_png_to_base64(image_path)}"
+    return f"data:{mime_type(image_path)};base64,{encode_image_to_base64(image_path)}"
@@ -0,0 +1,253 @@
+"""
+SQLite store of every decision, keyed by run, strategy, model, prompt and image
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from verdict import extract_decision, parse_decision, response_samples
+
+DEFAULT_STORE_PATH = "results/results.sqlite"
+# Columns the runners add next to the decision, kept out of the raw text
+META_COLUMNS = ("LLM-score", "LLM-margin", "Forensic-score", "Source", "Stage")
+RUN_PATTERN = re.compile(r"^(?P<split>Au|Sp)\w*?_llm_decisions_(?P<strategy>.+?)(?:_(?P<run>run\d+))?$")
+BASE_RUN = "run0"
+UNKNOWN = ""  # model and prompt hash of results imported from CSVs that did not record them
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decisions (
+    run_id TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    split TEXT,
+    source TEXT,
+    decision TEXT,
+    label TEXT,
+    raw_text TEXT,
+    score REAL,
+    latency_s REAL,
+    prompt_tokens INTEGER,
+    cached_tokens INTEGER,
+    completion_tokens INTEGER,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (run_id, strategy, model, prompt_hash, filename)
+);
+CREATE INDEX IF NOT EXISTS decisions_strategy_run ON decisions (strategy, run_id);
+CREATE INDEX IF NOT EXISTS decisions_filename ON decisions (filename);
+"""
+COLUMNS = ("run_id", "strategy", "model", "prompt_hash", "filename", "split", "source", "decision", "label",
+           "raw_text", "score", "latency_s", "prompt_tokens", "cached_tokens", "completion_tokens", "recorded_at")
+
+def parse_run_name(path):
+    """Return (split, strategy, run) of a results file such as results/Sp_sample_llm_decisions_few_shot_run1.csv.
+
+    Names outside the convention map to (None, <stem>, run0).
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    match = RUN_PATTERN.match(stem)
+    if not match:
+        return None, stem, BASE_RUN
+    return match.group('split'), match.group('strategy'), match.group('run') or BASE_RUN
+
+def read_decisions(path):
+    """Return the (filename, decision, score, raw_text) rows of a results CSV.
+
+    The score comes from an `LLM-score` column (NaN without one). Extra fields
+    other than the runners' own `META_COLUMNS`, such as the `Reason`/`Reasoning`
+    columns of the published runs, are joined into the raw text.
+    """
+    with open(path, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None) or []
+        score_column = header.index("LLM-score") if "LLM-score" in header else None
+        skipped = {i for i, name in enumerate(header) if name in META_COLUMNS}
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            score = row[score_column] if score_column is not None and len(row) > score_column else ""
+            extra = [value for i, value in enumerate(row[2:], start=2) if i not in skipped and value]
+            rows.append((row[0], row[1] if len(row) > 1 else "", float(score) if score else np.nan,
+                         "\n".join(extra) or None))
+        return rows
+
+def read_meta_columns(path):
+    """Return the non-empty values per filename of each of the runners' own columns in a results CSV but `LLM-score`.
+
+    They are the `columns` of `write_results_csv`, so a rewritten CSV keeps them.
+    """
+    with open(path, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None) or []
+        indices = {name: i for i, name in enumerate(header) if name in META_COLUMNS and name != "LLM-score"}
+        columns = {name: {} for name in indices}
+        for row in reader:
+            for name, i in indices.items():
+                if row and len(row) > i and row[i]:
+                    columns[name][row[0]] = row[i]
+        return columns
+
+@lru_cache(maxsize=1024)
+def _part_digest(url):
+    # Example images are the same string objects in every request, so each is hashed once
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+def prompt_hash(request):
+    """Return a hash of everything in a request except its target (last) image.
+
+    Requests of the same strategy, examples and settings share it whatever image they ask about.
+    """
+    digest = hashlib.sha256()
+    settings = {key: value for key, value in request.items() if key != "messages"}
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+    for message in request["messages"]:
+        content = message["content"]
+        parts = [{"type": "text", "text": content}] if isinstance(content, str) else content
+        last_image = max((i for i, part in enumerate(parts) if part["type"] == "image_url"), default=None)
+        for i, part in enumerate(parts):
+            if part["type"] == "text":
+                digest.update(b"t" + part["text"].encode('utf-8'))
+            elif i != last_image:
+                digest.update(b"i" + _part_digest(part["image_url"]["url"]).encode('ascii'))
+    return digest.hexdigest()[:16]
+
+class ResultsStore:
+    """SQLite table of decisions that concurrent runners append to and the analyses query.
+
+    WAL mode lets several runner processes append while analyses read.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        store_dir = os.path.dirname(path)
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def add_many(self, rows):
+        """Insert or replace decision rows given as dicts keyed by `COLUMNS` (missing keys are NULL)."""
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO decisions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+            [tuple(row.get(column) for column in COLUMNS) for row in rows]
+        )
+        self._conn.commit()
+
+    def import_csv(self, path, run_id=None, model=UNKNOWN):
+        """Import a results CSV as one run; returns the number of rows."""
+        split, strategy, run = parse_run_name(path)
+        now = time.time()
+        rows = [
+            {"run_id": run_id or run, "strategy": strategy, "model": model, "prompt_hash": UNKNOWN,
+             "filename": filename, "split": split, "source": os.path.basename(path), "decision": decision,
+             "label": parse_decision(decision), "raw_text": raw_text,
+             "score": None if np.isnan(score) else score, "recorded_at": now}
+            for filename, decision, score, raw_text in read_decisions(path)
+        ]
+        self.add_many(rows)
+        return len(rows)
+
+    def runs(self):
+        """Return one row per stored run and split with its number of prompts, decisions and unparsed answers."""
+        return pd.read_sql_query(
+            "SELECT strategy, run_id, model, split, COUNT(DISTINCT prompt_hash) AS prompts, "
+            "COUNT(*) AS decisions, SUM(label IS NULL) AS unparsed, "
+            "datetime(MAX(recorded_at), 'unixepoch') AS last_recorded "
+            "FROM decisions GROUP BY strategy, run_id, model, split ORDER BY strategy, run_id, split",
+            self._conn)
+
+    def read(self, strategies=None, run_ids=None, model=None):
+        """Return the stored decisions as a frame, optionally restricted to strategies, runs and a model."""
+        clauses, params = [], []
+        for column, values in (("strategy", strategies), ("run_id", run_ids)):
+            if values:
+                clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+        if model is not None:
+            clauses.append("model = ?")
+            params.append(model)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return pd.read_sql_query(f"SELECT * FROM decisions{where}", self._conn, params=params)
+
+    def close(self):
+        self._conn.close()
+
+class RunRecorder:
+    """Runner recorder that appends each decided request of one output to the store."""
+
+    def __init__(self, store, output_csv, run_id=None):
+        self.store = store
+        self.split, self.strategy, run = parse_run_name(output_csv)
+        self.run_id = run_id or run
+        self.source = os.path.basename(output_csv)
+
+    def record(self, image_path, request, response, started, built, stats, error=None):
+        """Store the decision, raw answer, score, latency and token usage of one request.
+
+        The raw answer of a multi-sample request is the JSON list of its samples.
+        """
+        if response is None:
+            return  # failed requests stay in the journal for --retry-errors, not in the store
+        decision, score = extract_decision(response)
+        samples = response_samples(response)
+        raw_text = response.choices[0].message.content if samples is None else json.dumps(samples)
+        self._add(image_path, request, response, decision, raw_text, score, stats)
+
+    def record_packed(self, image_path, request, response, decision, raw_text, stats, images):
+        """Store one image's answer from a packed request.
+
+        `request` is the image's own request, so its prompt hash matches unpacked
+        runs; the latency and tokens are its 1/`images` share of the packed call.
+        """
+        self._add(image_path, request, response, decision, raw_text, None, stats, images)
+
+    def _add(self, image_path, request, response, decision, raw_text, score, stats, images=1):
+        usage = response.usage
+        details = getattr(usage, 'prompt_tokens_details', None)
+
+        def share(value):
+            return None if value is None else round(value / images)
+        latency = stats.get("latency")
+        self.store.add_many([{
+            "run_id": self.run_id, "strategy": self.strategy, "model": request["model"],
+            "prompt_hash": prompt_hash(request), "filename": os.path.basename(image_path), "split": self.split,
+            "source": self.source, "decision": decision, "label": parse_decision(decision),
+            "raw_text": raw_text, "score": score, "latency_s": None if latency is None else latency / images,
+            "prompt_tokens": share(getattr(usage, 'prompt_tokens', None)),
+            "cached_tokens": share(getattr(details, 'cached_tokens', None)),
+            "completion_tokens": share(getattr(usage, 'completion_tokens', None)),
+            "recorded_at": time.time(),
+        }])
+
+def main():
+    parser = argparse.ArgumentParser(description="Import results CSVs into the results store or list its runs")
+    parser.add_argument("command", choices=["import", "runs"])
+    parser.add_argument("results", nargs="?", default="results/*_llm_decisions_*.csv",
+                        help="Glob of the results CSVs to import")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH)
+    parser.add_argument("--model", default=UNKNOWN, help="Model the imported runs were made with, if known")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == "import":
+        for path in sorted(glob.glob(args.results)):
+            print(f"Imported {store.import_csv(path, model=args.model)} rows from {path}")
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(store.runs())
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Similarity-based retrieval of in-context examples over cheap image descriptors
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from manifest import files_key
+
+DEFAULT_CACHE_DIR = ".cache/descriptors"
+HISTOGRAM_BINS = 4  # per RGB channel
+THUMBNAIL_SIDE = 8
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def compute_descriptor(image_path):
+    """Return the descriptor of an image: colour histogram, difference hash and grey thumbnail.
+
+    Each block is scaled to unit length so that none dominates the distance.
+    """
+    with Image.open(image_path) as image:
+        rgb = np.asarray(image.convert('RGB').resize((64, 64), Image.BILINEAR), dtype=np.int64)
+        grey = image.convert('L')
+        dhash_pixels = np.asarray(grey.resize((THUMBNAIL_SIDE + 1, THUMBNAIL_SIDE), Image.BILINEAR), dtype=np.float32)
+        thumbnail = np.asarray(grey.resize((THUMBNAIL_SIDE, THUMBNAIL_SIDE), Image.BILINEAR), dtype=np.float32)
+
+    # Joint RGB histogram over HISTOGRAM_BINS**3 colour cells
+    cells = (rgb * HISTOGRAM_BINS // 256).reshape(-1, 3)
+    index = (cells[:, 0] * HISTOGRAM_BINS + cells[:, 1]) * HISTOGRAM_BINS + cells[:, 2]
+    histogram = np.bincount(index, minlength=HISTOGRAM_BINS ** 3).astype(np.float32)
+
+    dhash = (dhash_pixels[:, 1:] > dhash_pixels[:, :-1]).astype(np.float32).ravel() - 0.5
+    thumbnail = thumbnail.ravel() - thumbnail.mean()
+
+    return np.concatenate([_unit(histogram), _unit(dhash), _unit(thumbnail)]).astype(np.float32)
+
+def compute_descriptors(image_paths, workers=None):
+    """Compute the descriptors of many images across a process pool as one (n, d) matrix."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.stack(list(pool.map(compute_descriptor, image_paths, chunksize=32)))
+
+class DescriptorIndex:
+    """Descriptor matrix of an example pool supporting vectorized nearest-neighbour queries."""
+
+    def __init__(self, paths, matrix):
+        self.paths = list(paths)
+        self.matrix = matrix
+        self._squared_norms = np.einsum('ij,ij->i', matrix, matrix)
+
+    @classmethod
+    def build(cls, image_paths, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+        """Load the pool's descriptors from the cache, computing them once when the pool changes."""
+        image_paths = sorted(image_paths)
+        cache_path = os.path.join(cache_dir, files_key(image_paths) + ".npy")
+
+        if os.path.exists(cache_path):
+            matrix = np.load(cache_path)
+        else:
+            matrix = compute_descriptors(image_paths, workers)
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(cache_path, matrix)
+        return cls(image_paths, matrix)
+
+    def nearest(self, descriptor, k):
+        """Return the paths of the k pool images closest to a descriptor, nearest first."""
+        k = min(k, len(self.paths))
+        # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2, with the constant ||a||^2 dropped
+        distances = self._squared_norms - 2.0 * (self.matrix @ descriptor)
+        top = np.argpartition(distances, k - 1)[:k]
+        return [self.paths[i] for i in top[np.argsort(distances[top])]]
@@ -0,0 +1,471 @@
+"""
+Concurrent evaluation runner shared by the prompt strategies
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from openai import AsyncOpenAI, OpenAI
+from batch import batch_stem, build_batch_shards, download_batch_outputs, ingest_batch_outputs, submit_batch_shards
+from cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, ResponseCache, cached_create_async
+from example_store import prefix_category
+from forensics import DEFAULT_BAND, route_locally
+from journal import (Journal, is_error, journal_path, read_journal, read_journal_samples, read_journal_scores,
+                     read_results_csv, write_results_csv)
+from packing import pack_key, pack_requests, parse_packed
+from results_store import DEFAULT_STORE_PATH, ResultsStore, RunRecorder
+from scheduler import DEFAULT_MAX_RETRIES, Scheduler
+from shards import parse_shard, select_shard, shard_name, shard_output
+from telemetry import Trace, trace_path
+from verdict import (SAMPLE_TEMPERATURE, VERDICT_MODES, extract_decision, make_sampling_builder,
+                     make_verdict_builder, response_samples, vote, vote_columns)
+import preprocess
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BATCH_DIR = "batches"
+DEFAULT_ENCODERS = 4  # reader/encoder tasks preparing requests ahead of the request stage
+
+def build_arg_parser(description, folder, output_csv):
+    """Return the command-line parser shared by the strategy scripts."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--folder", default=folder,
+                        help="Folder with the images to evaluate")
+    if output_csv is not None:
+        parser.add_argument("--output", default=output_csv,
+                            help="CSV file the decisions are written to")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Maximum number of requests in flight at once")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the response cache and always call the API")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH,
+                        help="SQLite file holding cached responses")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Size budget of the response cache before old entries are evicted")
+    parser.add_argument("--retry-errors", action="store_true",
+                        help="Re-submit only the images whose recorded decision is an error")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Discard the resume journal and evaluate every image again")
+    parser.add_argument("--batch", choices=["build", "submit", "ingest"],
+                        help="Use the Batch API: write request shards, also submit them, "
+                             "or ingest the finished outputs into the results CSV")
+    parser.add_argument("--batch-dir", default=DEFAULT_BATCH_DIR,
+                        help="Folder holding batch shards, batch ids and outputs")
+    parser.add_argument("--no-preprocess", action="store_true",
+                        help="Send the original image files without downscaling (TIFF/BMP are still converted to PNG)")
+    parser.add_argument("--max-side", type=int, default=preprocess.DEFAULT_OPTIONS["max_side"],
+                        help="Longest image side in pixels after preprocessing")
+    parser.add_argument("--max-kb", type=int,
+                        help="Upload budget per image in KiB after preprocessing")
+    parser.add_argument("--workers", type=int,
+                        help="Processes used to preprocess images (default: one per core)")
+    parser.add_argument("--verdict", nargs="?", const="logprobs", choices=VERDICT_MODES,
+                        help="Restrict answers to a single Authentic/Spliced verdict scored by its logprobs: "
+                             "one output token (default) or a JSON verdict via structured outputs")
+    parser.add_argument("--samples", type=int, default=1, metavar="N",
+                        help="Self-consistency: ask for N answers in one request and decide by majority vote; "
+                             "the samples are journaled and the vote margin goes in an LLM-margin column")
+    parser.add_argument("--temperature", type=float, default=SAMPLE_TEMPERATURE,
+                        help="Sampling temperature of the --samples answers")
+    parser.add_argument("--rpm", type=int,
+                        help="Cap on requests per minute (default: the limit reported by the API)")
+    parser.add_argument("--tpm", type=int,
+                        help="Cap on tokens per minute (default: the limit reported by the API)")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help="Retries of a request failing with 429, 5xx or a connection error")
+    parser.add_argument("--order", choices=["input", "category"], default="input",
+                        help="Send the images in input order, or grouped by example category so requests sharing "
+                             "a few-shot prefix run back to back and hit the provider's prompt cache")
+    parser.add_argument("--no-trace", action="store_true",
+                        help="Do not append per-request telemetry to <output>.trace.jsonl")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH,
+                        help="SQLite results store every decision is also recorded in")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Do not record decisions in the results store")
+    parser.add_argument("--run-id",
+                        help="Run id of the decisions in the results store (default: the output's _runN suffix)")
+    parser.add_argument("--prefetch", type=int,
+                        help="Images read and encoded ahead of the requests in flight (default: --concurrency)")
+    parser.add_argument("--pack", type=int, default=1, metavar="K",
+                        help="Ask about up to K target images sharing a prompt prefix in one request, answered as "
+                             "a JSON array; missing or malformed answers are resubmitted one image at a time")
+    parser.add_argument("--prefilter", action="store_true",
+                        help="Decide images with confident local forensic scores (forensics.py) without an API call")
+    parser.add_argument("--prefilter-band", type=float, nargs=2, default=DEFAULT_BAND, metavar=("LOW", "HIGH"),
+                        help="Forensic P(spliced) band left to the LLM; outside it images are decided locally")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="Decide only shard i (0 <= i < N) of the images, split by a stable filename hash, into "
+                             "shards/i-of-N/ next to the output; merge the shards with shards.py")
+    return parser
+
+def parse_args(parser):
+    """Parse the command line and apply the run-wide image preprocessing options."""
+    args = parser.parse_args()
+    if args.prefilter and args.batch:
+        parser.error("--prefilter routes the online runner only and cannot be combined with --batch")
+    if args.pack > 1 and (args.batch or args.verdict):
+        parser.error("--pack asks for its own JSON verdicts and cannot be combined with --batch or --verdict")
+    if args.samples > 1 and args.pack > 1:
+        parser.error("--samples votes over whole answers and cannot be combined with --pack")
+    preprocess.configure(not args.no_preprocess, max_side=args.max_side,
+                         max_bytes=args.max_kb * 1024 if args.max_kb else None)
+    return args
+
+def prepare_requests(image_path, builders):
+    """Read and encode one image and build its request for each output; runs in a worker thread.
+
+    `builders` maps outputs to their `build_request`. Returns a (request, started,
+    built, error) tuple per output. With several outputs the image is encoded once
+    and its data URL shared by their requests.
+    """
+    started = time.time()
+    try:
+        image_url = preprocess.image_data_url(image_path) if len(builders) > 1 else None
+    except Exception as e:
+        return {output_csv: (None, started, None, e) for output_csv in builders}
+    prepared = {}
+    for output_csv, build_request in builders.items():
+        try:
+            prepared[output_csv] = (build_request(image_path, image_url), started, time.time(), None)
+        except Exception as e:
+            prepared[output_csv] = (None, started, None, e)
+        started = time.time()
+    return prepared
+
+async def decide(client, semaphore, image_path, prepared, cache=None, scheduler=None, recorders=()):
+    """Send the prepared request of one image, returning its (decision, score, samples).
+
+    `prepared` is the image's (request, started, built, error) from `prepare_requests`.
+    Failures, including one while building the request, come back as an
+    `ERROR: ...` decision. Every request is passed to the recorders (the telemetry
+    trace and the results store). `samples` lists the answers of a multi-sample
+    request and is None otherwise.
+    """
+    request, started, built, error = prepared
+    response = samples = None
+    stats = {}
+    async with semaphore:
+        try:
+            if error is not None:
+                raise error
+            print(f"Processing {image_path}...")
+            response = await cached_create_async(client, request, cache, scheduler, stats)
+            result, score = extract_decision(response)
+            samples = response_samples(response)
+            if samples:
+                print(f"{result} (vote margin {vote(samples)[2]:.2f} over {len(samples)} samples)")
+            else:
+                print(result if score is None else f"{result} (P(spliced)={score:.3f})")
+        except Exception as e:
+            print(f"Error processing {image_path}: {e}")
+            error = str(e)
+            result, score = f"ERROR: {e}", None
+    for recorder in recorders:
+        recorder.record(image_path, request, response, started, built, stats, error)
+    return result, score, samples
+
+def with_local_decisions(decisions, local_decisions):
+    """Return the decisions with the local ones filling the images the API has not answered, and their columns.
+
+    Local decisions are never sent or journaled, so a later run without them asks
+    the API. The columns are `Source` (`forensic` or `llm`) and the local
+    `Forensic-score`, never `LLM-score`; there are none without local decisions.
+    """
+    if not local_decisions:
+        return decisions, {}
+    local = {filename: local_decisions[filename] for filename in local_decisions if is_error(decisions.get(filename))}
+    rows = dict(decisions, **{filename: decision for filename, (decision, _) in local.items()})
+    return rows, {
+        "Source": {filename: "forensic" if filename in local else "llm" for filename in rows},
+        "Forensic-score": {filename: f"{score:.6f}" for filename, (_, score) in local.items()},
+    }
+
+def load_decisions(output_csv, retry_errors=False, fresh=False):
+    """Return the decisions recorded by earlier attempts at this output."""
+    path = journal_path(output_csv)
+    if fresh and os.path.exists(path):
+        os.remove(path)
+
+    decisions = read_journal(path)
+    if not decisions and retry_errors and os.path.exists(output_csv):
+        # Seed the journal from a results CSV written without one
+        decisions = read_results_csv(output_csv)
+        journal = Journal(path)
+        for filename, decision in decisions.items():
+            journal.record(filename, decision)
+        journal.close()
+    return decisions
+
+def select_pending(image_paths, decisions, retry_errors=False):
+    """Return the images still to submit: the undecided ones, or only the failed ones when retrying errors."""
+    if retry_errors:
+        pending = [path for path in image_paths
+                   if os.path.basename(path) in decisions and is_error(decisions[os.path.basename(path)])]
+    else:
+        pending = [path for path in image_paths if os.path.basename(path) not in decisions]
+    print(f"{len(pending)} of {len(image_paths)} images to process")
+    return pending
+
+async def run_strategies_async(image_paths, strategies, concurrency=DEFAULT_CONCURRENCY,
+                               cache=None, retry_errors=False, fresh=False, client=None, scheduler=None,
+                               trace=True, order=None, store=None, run_id=None, prefetch=None,
+                               local_decisions=None, pack=1, workers=None):
+    """Evaluate the images under one or more strategies with up to `concurrency` requests in flight.
+
+    `strategies` maps each results CSV to its `build_request(image_path, image_url)`;
+    every image is read and encoded once for all of them. Decisions are journaled
+    as they arrive, so a restart resumes, and the CSVs are rebuilt from the journals
+    in input order when the run ends or is interrupted. The other options are the
+    runner flags of `build_arg_parser`; `local_decisions` are those of `--prefilter`
+    (see `with_local_decisions`).
+    """
+    decisions, scores, samples, pending, journals, traces, stored, recorders = {}, {}, {}, {}, {}, {}, {}, {}
+    local_decisions = local_decisions or {}
+    api_paths = [path for path in image_paths if os.path.basename(path) not in local_decisions]
+    for output_csv in strategies:
+        decisions[output_csv] = load_decisions(output_csv, retry_errors, fresh)
+        scores[output_csv] = read_journal_scores(journal_path(output_csv))
+        samples[output_csv] = read_journal_samples(journal_path(output_csv))
+        journals[output_csv] = Journal(journal_path(output_csv))
+        pending[output_csv] = set(select_pending(api_paths, decisions[output_csv], retry_errors))
+        traces[output_csv] = Trace(trace_path(output_csv)) if trace else None
+        stored[output_csv] = RunRecorder(store, output_csv, run_id) if store else None
+        recorders[output_csv] = [recorder for recorder in (traces[output_csv], stored[output_csv]) if recorder]
+
+    # A client the runner creates is closed with its event loop; one passed in belongs to the caller
+    owns_client = client is None
+    client = client or AsyncOpenAI(max_retries=0)
+    scheduler = scheduler or Scheduler()
+    semaphore = asyncio.Semaphore(concurrency)
+    # Bounds the encoded payloads held in memory to the queue depth plus the requests in flight
+    ready = asyncio.Queue(maxsize=prefetch or concurrency)
+
+    def record(output_csv, filename, decision, score, answers=None):
+        journals[output_csv].record(filename, decision, score, answers)
+        decisions[output_csv][filename] = decision
+        for values, value in ((scores[output_csv], score), (samples[output_csv], answers)):
+            if value is None:
+                values.pop(filename, None)
+            else:
+                values[filename] = value
+
+    async def decide_and_record(output_csv, path, prepared):
+        decision, score, answers = await decide(client, semaphore, path, prepared, cache, scheduler,
+                                                recorders[output_csv])
+        record(output_csv, os.path.basename(path), decision, score, answers)
+
+    async def decide_pack(output_csv, members):
+        # One request for the (path, prepared) members; the images it does not answer validly go on their own
+        packed = pack_requests([prepared[0] for _, prepared in members])
+        started = min(prepared[1] for _, prepared in members)
+        built = max(prepared[2] for _, prepared in members)
+        stats = {}
+        response = error = None
+        answers = {}
+        async with semaphore:
+            try:
+                print(f"Processing {len(members)} packed images...")
+                response = await cached_create_async(client, packed, cache, scheduler, stats)
+                answers = parse_packed(response.choices[0].message.content, len(members))
+            except Exception as e:
+                print(f"Error processing a pack of {len(members)} images: {e}")
+                error = str(e)
+        # Only the answered images count for the call; the others are traced again when resubmitted
+        stats["images"] = len(answers)
+        if traces[output_csv]:
+            traces[output_csv].record(members[0][0], packed, response, started, built, stats, error)
+
+        resubmit = []
+        for index, (path, prepared) in enumerate(members, start=1):
+            if index not in answers:
+                resubmit.append((path, prepared))
+                continue
+            label, reasoning = answers[index]
+            record(output_csv, os.path.basename(path), label.capitalize(), None)
+            if stored[output_csv]:
+                stored[output_csv].record_packed(path, prepared[0], response, label.capitalize(), reasoning, stats,
+                                                 len(answers))
+        if resubmit:
+            print(f"{len(resubmit)} of {len(members)} packed answers missing or malformed; resubmitting them")
+            await asyncio.gather(*(decide_and_record(output_csv, path, prepared) for path, prepared in resubmit))
+
+    packs = {}
+
+    async def add_to_packs(path, prepared):
+        # Buffers the image's requests by output and prompt prefix, queueing every pack that fills up;
+        # the waiting requests add at most `pack - 1` encoded images per output and prefix
+        unpacked = {}
+        for output_csv, item in prepared.items():
+            if item[3] is not None:
+                unpacked[output_csv] = item
+                continue
+            key = (output_csv, pack_key(item[0]))
+            members = packs.setdefault(key, [])
+            members.append((path, item))
+            if len(members) == pack:
+                del packs[key]
+                await ready.put(("pack", output_csv, members))
+        return unpacked
+
+    async def encode(paths):
+        # Reader/encoder stage: the next images are read, encoded and built while requests are in flight
+        for path in paths:
+            builders = {output_csv: build_request for output_csv, build_request in strategies.items()
+                        if path in pending[output_csv]}
+            if not builders:
+                continue
+            await preprocess.prepare_async(path, pool)
+            prepared = await asyncio.to_thread(prepare_requests, path, builders)
+            if pack > 1:
+                prepared = await add_to_packs(path, prepared)
+            if prepared:
+                await ready.put(("image", path, prepared))
+
+    async def produce(paths):
+        await asyncio.gather(*(encode(paths) for _ in range(encoders)))
+        for (output_csv, _), members in list(packs.items()):
+            if len(members) > 1:
+                await ready.put(("pack", output_csv, members))
+            else:
+                path, item = members[0]
+                await ready.put(("image", path, {output_csv: item}))
+        for _ in range(concurrency):
+            await ready.put(None)
+
+    warmed = {}
+
+    async def send():
+        # Request stage: pulls prepared requests until the producer's end marker
+        while (item := await ready.get()) is not None:
+            kind, target, prepared = item
+            path = target if kind == "image" else prepared[0][0]
+            leader = False
+            # Images sharing an order key wait for the first, so the provider caches its prompt prefix for them
+            if order is not None:
+                key = order(path)
+                leader = key not in warmed
+                if leader:
+                    warmed[key] = asyncio.Event()
+                else:
+                    await warmed[key].wait()
+            try:
+                if kind == "pack":
+                    await decide_pack(target, prepared)
+                else:
+                    await asyncio.gather(*(decide_and_record(output_csv, path, prepared[output_csv])
+                                           for output_csv in prepared))
+            finally:
+                if leader:
+                    warmed[key].set()
+
+    # The encoders share one iterator, so each image is prepared once
+    paths = iter(sorted(image_paths, key=order) if order is not None else image_paths)
+    # Images are preprocessed across a process pool as the encoders reach them, one per encoder at a time
+    pool = preprocess.start_pool(workers)
+    encoders = max(DEFAULT_ENCODERS, workers or os.cpu_count() or 1) if pool else DEFAULT_ENCODERS
+    try:
+        await asyncio.gather(produce(paths), *(send() for _ in range(concurrency)))
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        if owns_client:
+            await client.close()
+        filenames = [os.path.basename(path) for path in image_paths]
+        for output_csv in strategies:
+            journals[output_csv].close()
+            if traces[output_csv]:
+                traces[output_csv].close()
+            rows, columns = with_local_decisions(decisions[output_csv], local_decisions)
+            write_results_csv(output_csv, rows, filenames, scores[output_csv],
+                              dict(vote_columns(samples[output_csv]) or {}, **columns) or None)
+
+    for output_csv in strategies:
+        errors = sum(is_error(decisions[output_csv].get(os.path.basename(path))) for path in pending[output_csv])
+        print(f"\nProcessing complete. Results saved to: {output_csv} ({errors} errors)")
+        if traces[output_csv] and traces[output_csv].prompt_tokens:
+            cached, prompt = traces[output_csv].cached_tokens, traces[output_csv].prompt_tokens
+            print(f"Prompt cache: {cached} of {prompt} prompt tokens cached ({cached / prompt:.1%})")
+    if scheduler.retries:
+        print(f"{scheduler.retries} requests were retried")
+
+def category_order(image_path):
+    """Sort key grouping images by the example category their few-shot prefix is built for."""
+    return prefix_category(os.path.basename(image_path)) or ""
+
+def with_prompt_cache_key(build_request, output_csv):
+    """Wrap a request builder so requests sharing a prefix carry the same `prompt_cache_key`.
+
+    The key routes them to the same prompt cache on the provider side.
+    """
+    name = os.path.splitext(os.path.basename(output_csv))[0]
+
+    def build_keyed_request(image_path, image_url=None):
+        request = build_request(image_path, image_url)
+        return dict(request, prompt_cache_key=f"{name}:{category_order(image_path)}")
+
+    return build_keyed_request
+
+def run_batch(image_paths, build_request, output_csv, mode, batch_dir=DEFAULT_BATCH_DIR,
+              retry_errors=False, fresh=False):
+    """Build or submit Batch API shards for the pending images, or ingest finished batch outputs."""
+    stem = batch_stem(batch_dir, output_csv)
+
+    if mode == "ingest":
+        if os.path.exists(f"{stem}.batches.json") and not download_batch_outputs(OpenAI(), stem):
+            print("Some batches are still running; ingesting the finished ones")
+        ingest_batch_outputs(stem, output_csv, [os.path.basename(path) for path in image_paths])
+        return
+
+    decisions = load_decisions(output_csv, retry_errors, fresh)
+    shard_paths = build_batch_shards(select_pending(image_paths, decisions, retry_errors), build_request, stem)
+    if mode == "submit":
+        submit_batch_shards(OpenAI(), shard_paths, stem)
+
+def run_strategies_with_args(image_paths, strategies, args):
+    """Run the evaluation of one or more strategies configured by the options of `build_arg_parser`."""
+    batch_dir = args.batch_dir
+    if args.shard:
+        index, count = args.shard
+        image_paths = select_shard(image_paths, index, count)
+        strategies = {shard_output(output_csv, index, count): build_request
+                      for output_csv, build_request in strategies.items()}
+        batch_dir = os.path.join(batch_dir, shard_name(index, count))
+        print(f"Shard {shard_name(index, count)}: {len(image_paths)} images")
+    if args.verdict:
+        strategies = {output_csv: make_verdict_builder(build_request, args.verdict)
+                      for output_csv, build_request in strategies.items()}
+    if args.samples > 1:
+        # After the verdict wrapper, whose requests are otherwise greedy
+        strategies = {output_csv: make_sampling_builder(build_request, args.samples, args.temperature)
+                      for output_csv, build_request in strategies.items()}
+    order = None
+    if args.order == "category":
+        order = category_order
+        strategies = {output_csv: with_prompt_cache_key(build_request, output_csv)
+                      for output_csv, build_request in strategies.items()}
+
+    if args.batch:
+        if args.batch != "ingest":
+            preprocess.prepare(image_paths, args.workers)
+        for output_csv, build_request in strategies.items():
+            run_batch(image_paths, build_request, output_csv, args.batch, batch_dir,
+                      args.retry_errors, args.fresh)
+            if args.batch == "ingest" and not args.no_store:
+                # Batch outputs carry no latency, so the store gets the ingested CSV rows
+                ResultsStore(args.store).import_csv(output_csv, args.run_id)
+        return
+
+    store = None if args.no_store else ResultsStore(args.store)
+    cache = None if args.no_cache else ResponseCache(args.cache_path, args.cache_max_mb * 1024 * 1024)
+    scheduler = Scheduler(args.rpm, args.tpm, args.max_retries)
+    local_decisions = None
+    if args.prefilter:
+        local_decisions = route_locally(image_paths, tuple(args.prefilter_band), workers=args.workers)
+    asyncio.run(run_strategies_async(image_paths, strategies, args.concurrency, cache,
+                                     args.retry_errors, args.fresh, scheduler=scheduler, trace=not args.no_trace,
+                                     order=order, store=store, run_id=args.run_id, prefetch=args.prefetch,
+                                     local_decisions=local_decisions, pack=args.pack, workers=args.workers))
+
+def run_with_args(image_paths, build_request, args):
+    """Run the evaluation configured by the options of `build_arg_parser`."""
+    run_strategies_with_args(image_paths, {args.output: build_request}, args)
@@ -2,69 +2,49 @@
 Sampling datasets from the original CASIA v2.0 dataset
 """
 import os
-import shutil
-from collections import Counter
-import re
+from manifest import (DEFAULT_MANIFEST_PATH, category_counts, index_folder, materialize_view, open_manifest,
+                      pool_name, save_subset, select_authentic, select_spliced)
 
 # Configuration
 VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
-def sample_authentic(input_dir="CASIA2/Au", output_dir='CASIA2/Au_sample'):
+def sample_authentic(input_dir="CASIA2/Au", output_dir='CASIA2/Au_sample',
+                     manifest_path=DEFAULT_MANIFEST_PATH, mode='symlink'):
 
-    # Make sure output directory exists
-    os.makedirs(output_dir, exist_ok=True)
+    conn = open_manifest(manifest_path)
 
-    # Step 1: Gather all files and extract categories
-    category_counter = Counter()
-    file_map = {}
+    # Step 1: Refresh the manifest (only new or changed files are read)
+    index_folder(conn, input_dir)
 
-    pattern = re.compile(r"^Au_(\w+)_\d+\.(?:jpg|jpeg|png)$", re.IGNORECASE)
-
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(VALID_EXTENSIONS):
-            match = pattern.match(filename)
-            if match:
-                category = match.group(1)
-                category_counter[category] += 1
-                file_map.setdefault(category, []).append(filename)
-
-    # Step 2: Identify top 5 categories
-    top_categories = [cat for cat, _ in category_counter.most_common(3)]
+    # Step 2: Identify top 3 categories
+    top_categories = [cat for cat, _ in category_counts(conn, input_dir, VALID_EXTENSIONS)[:3]]
     print(f"The top 3 categories are: {top_categories}")
 
-    # Step 3: Copy files from top categories
-    for category in top_categories:
-        for file in file_map[category]:
-            src = os.path.join(input_dir, file)
-            dst = os.path.join(output_dir, file)
-            shutil.copy2(src, dst)
+    # Step 3: Record the files from top categories and link them into the sample view
+    filenames = select_authentic(conn, input_dir, top_categories, VALID_EXTENSIONS)
+    save_subset(conn, os.path.basename(output_dir), input_dir, filenames)
+    save_subset(conn, pool_name(os.path.basename(output_dir)), input_dir, filenames)
+    materialize_view(input_dir, filenames, output_dir, mode)
+    conn.close()
 
-    print("Sampling complete. Files copied to:", output_dir)
+    print("Sampling complete. Files linked to:", output_dir)
 
     return top_categories
 
-def sample_spliced(input_dir="CASIA2/Tp", output_dir='CASIA2/Sp_sample', categories=None):
+def sample_spliced(input_dir="CASIA2/Tp", output_dir='CASIA2/Sp_sample', categories=None,
+                   manifest_path=DEFAULT_MANIFEST_PATH, mode='symlink'):
     if categories is None or not categories:
         raise ValueError("You must provide a list of top categories.")
 
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Pattern: Tp_<D|S>_XXX_X_X_<src_category><id>_<dst_category><id>_<id>.ext
-    pattern = re.compile(
-        r"^Tp_D_[^_]+_[^_]+_[^_]+_([a-zA-Z]+)\d+_([a-zA-Z]+)\d+_\d+\.(jpg|jpeg|png)$",
-        re.IGNORECASE
-    )
-
-    matched_files = []
+    conn = open_manifest(manifest_path)
+    index_folder(conn, input_dir)
 
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(VALID_EXTENSIONS):
-            match = pattern.match(filename)
-            if match:
-                src_cat, dst_cat = match.group(1).lower(), match.group(2).lower()
-                if src_cat in categories or dst_cat in categories:
-                    matched_files.append(filename)
-                    shutil.copy2(os.path.join(input_dir, filename), os.path.join(output_dir, filename))
+    # Different-source splices (Tp_D_...) whose source or destination is a top category
+    matched_files = select_spliced(conn, input_dir, categories, 'D', VALID_EXTENSIONS)
+    save_subset(conn, os.path.basename(output_dir), input_dir, matched_files)
+    save_subset(conn, pool_name(os.path.basename(output_dir)), input_dir, matched_files)
+    materialize_view(input_dir, matched_files, output_dir, mode)
+    conn.close()
 
     print(f"Sampled {len(matched_files)} tampered (spliced) images to {output_dir}")
 
@@ -74,4 +54,4 @@ def main():
     sample_spliced(categories=top_categories)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,165 @@
+"""
+Rate-limit-aware request scheduling with retries driven by the API's response headers
+"""
+
+import asyncio
+import random
+import threading
+import time
+from openai import APIConnectionError, APIStatusError, RateLimitError
+from tokens import estimate_request_tokens
+
+DEFAULT_MAX_RETRIES = 8
+BACKOFF_BASE = 1.0   # seconds before the first retry, doubled on every attempt
+BACKOFF_CAP = 60.0
+
+class TokenBucket:
+    """Per-minute budget refilled continuously; reservations may run into debt that callers wait out."""
+
+    def __init__(self, per_minute=None):
+        self.capacity = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def reserve(self, amount):
+        """Take `amount` from the bucket and return the seconds to wait before using it."""
+        with self._lock:
+            if self.capacity is None:
+                return 0.0
+            self._refill()
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level * 60 / self.capacity)
+
+    def observe(self, limit, remaining):
+        """Adopt the limit reported by the API and never assume more headroom than it reports."""
+        with self._lock:
+            self._refill()
+            if self.capacity is None:
+                self.level = remaining
+            self.capacity = limit
+            self.level = min(self.level, remaining)
+
+    def drain(self):
+        """Empty the bucket so every caller pauses, e.g. after a 429."""
+        with self._lock:
+            if self.capacity is not None:
+                self._refill()
+                self.level = min(self.level, 0)
+
+def _header_int(headers, name):
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def retry_delay(error, attempt):
+    """Return the seconds to wait before retrying a failed request, or None if it should not be retried.
+
+    429s, 5xx responses and connection errors are retried. The delay is the
+    server's `retry-after` when given, otherwise full-jitter exponential backoff.
+    """
+    if isinstance(error, APIStatusError):
+        if not isinstance(error, RateLimitError) and error.status_code < 500:
+            return None
+        if getattr(error, "code", None) == "insufficient_quota":
+            return None  # a 429 that no amount of waiting fixes
+        headers = error.response.headers
+        if _header_int(headers, "retry-after-ms") is not None:
+            return _header_int(headers, "retry-after-ms") / 1000
+        if _header_int(headers, "retry-after") is not None:
+            return float(_header_int(headers, "retry-after"))
+    elif not isinstance(error, APIConnectionError):
+        return None
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+class Scheduler:
+    """Paces requests under requests-per-minute and tokens-per-minute budgets and retries transient failures.
+
+    The budgets start from `rpm`/`tpm` (unlimited when None) and follow the
+    `x-ratelimit-*` headers of every response; explicit `rpm`/`tpm` stay as caps.
+    Each request is charged its estimated prompt tokens, images included, plus
+    its `max_tokens`, before it is sent.
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_retries=DEFAULT_MAX_RETRIES):
+        self.rpm_cap = rpm
+        self.tpm_cap = tpm
+        self.max_retries = max_retries
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.retries = 0
+
+    def _reserve(self, request):
+        cost = estimate_request_tokens(request)
+        return max(self.requests.reserve(1), self.tokens.reserve(cost))
+
+    def _observe(self, headers):
+        for bucket, kind, cap in ((self.requests, "requests", self.rpm_cap), (self.tokens, "tokens", self.tpm_cap)):
+            limit = _header_int(headers, f"x-ratelimit-limit-{kind}")
+            remaining = _header_int(headers, f"x-ratelimit-remaining-{kind}")
+            if limit is not None and remaining is not None:
+                bucket.observe(min(limit, cap) if cap else limit, remaining)
+
+    def _on_error(self, error, attempt):
+        delay = retry_delay(error, attempt)
+        if delay is None or attempt >= self.max_retries:
+            raise error
+        if isinstance(error, RateLimitError):
+            self.requests.drain()
+            self.tokens.drain()
+        self.retries += 1
+        print(f"Retrying in {delay:.1f}s after {type(error).__name__} (attempt {attempt + 1})")
+        return delay
+
+    def create(self, client, request, stats=None):
+        """Send a chat completion through an OpenAI client within the budgets, retrying transient errors.
+
+        `stats`, when given, receives the retries, the time spent waiting on the
+        budgets and backoff, and the latency of the successful attempt.
+        """
+        stats = {} if stats is None else stats
+        stats.update(retries=0, wait=0.0)
+        for attempt in range(self.max_retries + 1):
+            delay = self._reserve(request)
+            stats["wait"] += delay
+            time.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                raw = client.chat.completions.with_raw_response.create(**request)
+            except (APIStatusError, APIConnectionError) as e:
+                delay = self._on_error(e, attempt)
+                stats["retries"] += 1
+                stats["wait"] += delay
+                time.sleep(delay)
+                continue
+            stats["latency"] = time.perf_counter() - sent
+            self._observe(raw.headers)
+            return raw.parse()
+
+    async def create_async(self, client, request, stats=None):
+        """Async counterpart of `create` for an AsyncOpenAI client."""
+        stats = {} if stats is None else stats
+        stats.update(retries=0, wait=0.0)
+        for attempt in range(self.max_retries + 1):
+            delay = self._reserve(request)
+            stats["wait"] += delay
+            await asyncio.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                raw = await client.chat.completions.with_raw_response.create(**request)
+            except (APIStatusError, APIConnectionError) as e:
+                delay = self._on_error(e, attempt)
+                stats["retries"] += 1
+                stats["wait"] += delay
+                await asyncio.sleep(delay)
+                continue
+            stats["latency"] = time.perf_counter() - sent
+            self._observe(raw.headers)
+            return raw.parse()
@@ -0,0 +1,104 @@
+"""
+Deterministic sharding of an evaluation across processes or hosts, and the merge of the shard outputs
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import numpy as np
+from journal import is_error, write_results_csv
+from manifest import iter_image_paths
+from results_store import read_decisions, read_meta_columns
+
+SHARDS_DIR = "shards"
+
+def parse_shard(value):
+    """Parse an `i/N` shard spec (0 <= i < N) into (i, N); used as an argparse type."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must satisfy 0 <= i < N, got {value!r}")
+    return index, count
+
+def shard_of(filename, count):
+    """Return the shard of a filename: a stable hash, identical in every process and on every host."""
+    digest = hashlib.blake2b(os.path.basename(filename).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+def select_shard(image_paths, index, count):
+    """Return the images of shard `index` out of `count`, in input order."""
+    return [path for path in image_paths if shard_of(path, count) == index]
+
+def shard_name(index, count):
+    return f"{index}-of-{count}"
+
+def shard_output(output_csv, index, count):
+    """Return the partial results CSV of a shard, e.g. results/shards/1-of-4/<name>.csv.
+
+    Keeping the file name means the shard's journal, trace and store entries are
+    named like the canonical output, and the results/*.csv globs never see it.
+    """
+    return os.path.join(os.path.dirname(output_csv), SHARDS_DIR, shard_name(index, count),
+                        os.path.basename(output_csv))
+
+def merge_shards(output_csv, image_paths, count, partial=False):
+    """Merge the shard outputs into the canonical CSV after checking every input was decided exactly once.
+
+    Returns True when the merge is complete. Images missing from every shard,
+    decided by more than one, found in the wrong shard or recorded as errors are
+    reported. Without `partial` nothing is written unless all inputs are decided.
+    """
+    filenames = [os.path.basename(path) for path in image_paths]
+    decisions, scores, columns, seen = {}, {}, {}, {}
+    misplaced = []
+    for index in range(count):
+        path = shard_output(output_csv, index, count)
+        if not os.path.exists(path):
+            print(f"Shard {shard_name(index, count)} has no output at {path}")
+            continue
+        for filename, decision, score, _ in read_decisions(path):
+            seen[filename] = seen.get(filename, 0) + 1
+            decisions[filename] = decision
+            if not np.isnan(score):
+                scores[filename] = score
+            if shard_of(filename, count) != index:
+                misplaced.append(filename)
+        for name, values in read_meta_columns(path).items():
+            columns.setdefault(name, {}).update(values)
+
+    inputs = set(filenames)
+    missing = [name for name in filenames if name not in decisions]
+    duplicated = [name for name, times in seen.items() if times > 1]
+    errors = [name for name in filenames if name in decisions and is_error(decisions[name])]
+    unexpected = [name for name in decisions if name not in inputs]
+
+    for label, names in (("missing", missing), ("decided more than once", duplicated),
+                         ("in the wrong shard", misplaced), ("recorded as errors", errors),
+                         ("not among the inputs", unexpected)):
+        if names:
+            print(f"{len(names)} images {label}, e.g. {', '.join(names[:3])}")
+
+    complete = not (missing or duplicated or misplaced or errors or unexpected)
+    if complete or partial:
+        write_results_csv(output_csv, decisions, filenames, scores, columns or None)
+        print(f"Merged {count} shards into {output_csv}: {len(decisions)} of {len(filenames)} images decided")
+    return complete
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the shard outputs of a sharded run into the results CSVs")
+    parser.add_argument("outputs", nargs="+", help="Canonical results CSVs to produce")
+    parser.add_argument("--folder", required=True, help="Folder of the evaluated images")
+    parser.add_argument("--shards", type=int, required=True, help="Number of shards N the run used")
+    parser.add_argument("--partial", action="store_true",
+                        help="Write the merged CSV even when some images are missing or failed")
+    args = parser.parse_args()
+
+    image_paths = sorted(iter_image_paths(args.folder))
+    complete = [merge_shards(output_csv, image_paths, args.shards, args.partial) for output_csv in args.outputs]
+    sys.exit(0 if all(complete) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Per-request telemetry trace of the runners and its latency, throughput and cost summary
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+import pandas as pd
+from manifest import parse_filename
+from metrics import RUN_PATTERN, category_memberships
+
+TRACE_SUFFIX = ".trace.jsonl"
+TRACE_GLOB = "results/*" + TRACE_SUFFIX
+
+# USD per million (input, cached input, output) tokens
+PRICES_PER_MILLION = {
+    "gpt-4.1-2025-04-14": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini-2025-04-14": (0.40, 0.10, 1.60),
+    "gpt-4o-2024-08-06": (2.50, 1.25, 10.00),
+}
+
+def trace_path(output_csv):
+    """Return the trace file kept next to a results CSV."""
+    return output_csv + TRACE_SUFFIX
+
+def payload_bytes(request):
+    """Return the size of a request's message content: its text plus the data URLs of its images."""
+    total = 0
+    for message in request["messages"]:
+        content = message["content"]
+        if isinstance(content, str):
+            total += len(content)
+            continue
+        for part in content:
+            total += len(part["text"]) if part["type"] == "text" else len(part["image_url"]["url"])
+    return total
+
+def request_cost(model, prompt_tokens, cached_tokens, completion_tokens):
+    """Return the estimated USD cost of one request, or None for a model without a known price."""
+    if model not in PRICES_PER_MILLION:
+        return None
+    input_price, cached_price, output_price = PRICES_PER_MILLION[model]
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1e6
+
+class Trace:
+    """Append-only JSONL trace with one line per request."""
+
+    def __init__(self, path):
+        self.path = path
+        trace_dir = os.path.dirname(path)
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        # Runs resumed later append to the same file; the session tells their records apart
+        self.session = time.time()
+        # Prompt tokens billed by the API in this run and how many of them its prompt cache served
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, image_path, request, response, started, built, stats, error=None):
+        """Append the timings, payload, token usage, retries and cost of one request."""
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+        cache_hit = stats.get("cache_hit", False)
+        model = request["model"] if request else None
+        if not cache_hit:
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+        entry = {
+            "output": os.path.basename(self.path[:-len(TRACE_SUFFIX)]),
+            "session": self.session,
+            "filename": os.path.basename(image_path),
+            "model": model,
+            "started": started,
+            "finished": time.time(),
+            "build_s": built - started if built else None,
+            "wait_s": stats.get("wait", 0.0),
+            "latency_s": stats.get("latency"),
+            "payload_bytes": payload_bytes(request) if request else None,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "retries": stats.get("retries", 0),
+            "images": stats.get("images", 1),  # target images of a packed request
+            "cache_hit": cache_hit,
+            # Answers from the local response cache cost nothing
+            "cost": 0.0 if cache_hit or not model else request_cost(model, prompt_tokens, cached_tokens,
+                                                                    completion_tokens),
+            "error": error,
+        }
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def load_traces(pattern=TRACE_GLOB):
+    """Load every trace matching the glob into one frame with strategy and category columns."""
+    rows = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    if not rows:
+        raise FileNotFoundError(f"No trace records match {pattern}")
+
+    df = pd.DataFrame(rows)
+    df['images'] = df['images'].fillna(1) if 'images' in df else 1
+    # Traces written before sessions were recorded count as one session per file
+    df['session'] = df['session'].fillna(0.0) if 'session' in df else 0.0
+    stems = df['output'].str.replace(r"\.csv$", "", regex=True)
+    runs = stems.str.extract(RUN_PATTERN.pattern)
+    df['strategy'] = runs['strategy'].fillna(stems)
+    parsed = pd.DataFrame([parse_filename(name) for name in df['filename']],
+                          columns=['truth', 'category', 'splice_type', 'src_category', 'dst_category'],
+                          index=df.index)
+    return pd.concat([df, parsed.drop(columns='splice_type')], axis=1)
+
+def summarize(df, keys):
+    """Return latency percentiles, throughput, tokens and cost per group.
+
+    `requests` counts API calls and `images` their target images, which differ for packed requests.
+    Throughput divides the images by the wall time of each session of each output
+    summed, so the idle time between runs appended to a trace is not counted.
+    """
+    network = df[~df['cache_hit'] & df['latency_s'].notna()]
+    latency = network.groupby(keys)['latency_s'].quantile([0.5, 0.95, 0.99]).unstack()
+    latency.columns = ['latency_p50', 'latency_p95', 'latency_p99']
+
+    grouped = df.groupby(keys)
+    table = grouped.agg(
+        requests=('filename', 'size'),
+        images=('images', 'sum'),
+        errors=('error', 'count'),
+        cache_hits=('cache_hit', 'sum'),
+        retries=('retries', 'sum'),
+        build_mean_s=('build_s', 'mean'),
+        payload_mean_kb=('payload_bytes', lambda x: x.mean() / 1024),
+        prompt_tokens=('prompt_tokens', 'sum'),
+        cached_tokens=('cached_tokens', 'sum'),
+        completion_tokens=('completion_tokens', 'sum'),
+        cost_usd=('cost', 'sum'),
+    )
+    sessions = df.groupby(keys + ['output', 'session'])
+    span = (sessions['finished'].max() - sessions['started'].min()).groupby(level=keys).sum()
+    table['images_per_s'] = table['images'] / span.where(span > 0)
+    table['cached_share'] = table['cached_tokens'] / table['prompt_tokens'].where(table['prompt_tokens'] > 0)
+    table['cost_per_1k_images'] = table['cost_usd'] / table['images'].where(table['images'] > 0) * 1000
+    return table.join(latency)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the request traces written by the runners")
+    parser.add_argument("traces", nargs="?", default=TRACE_GLOB, help="Glob of the trace files to load")
+    parser.add_argument("--by", choices=["strategy", "category"], default="strategy", help="Breakdown to print")
+    args = parser.parse_args()
+
+    df = load_traces(args.traces)
+    if args.by == "category":
+        table = summarize(category_memberships(df), ['strategy', 'category_group'])
+    else:
+        table = summarize(df, ['strategy'])
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 250,
+                           'display.precision', 4):
+        print(table)
+
+if __name__ == "__main__":
+    main()
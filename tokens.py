@@ -0,0 +1,93 @@
+"""
+Token estimates of chat completion requests, including their images, before they are sent
+"""
+
+import base64
+import hashlib
+import io
+import math
+from PIL import Image
+
+# Vision tiling of the GPT-4o / GPT-4.1 family at detail "high"
+BASE_IMAGE_TOKENS = 85
+TILE_TOKENS = 170
+TILE_SIDE = 512
+MAX_SIDE = 2048
+SHORT_SIDE = 768
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+HEADER_PROBE_BYTES = 64 * 1024  # enough of an encoded image to reach its size header
+SIZE_CACHE_ENTRIES = 4096
+
+# Image sizes by (header digest, payload length); the example images of every request hit it
+_sizes = {}
+
+def image_tokens(width, height, detail="high"):
+    """Return the prompt tokens of an image of the given size.
+
+    The image is scaled to fit 2048 x 2048, then its short side to 768 px, and
+    every 512 px tile costs 170 tokens on top of a fixed 85.
+    """
+    if detail == "low":
+        return BASE_IMAGE_TOKENS
+    scale = min(1.0, MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, SHORT_SIDE / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / TILE_SIDE) * math.ceil(height / TILE_SIDE)
+    return BASE_IMAGE_TOKENS + TILE_TOKENS * tiles
+
+def text_tokens(text):
+    """Return a character-based estimate of the tokens of a text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def data_url_size(url):
+    """Return the (width, height) of a base64 image data URL, decoding only its header when possible.
+
+    Sizes are cached under a digest of the header and the payload length, so the
+    cache holds no image data.
+    """
+    encoded = url.partition(",")[2]
+    probe = encoded[:HEADER_PROBE_BYTES // 3 * 4]
+    key = (hashlib.blake2b(probe.encode('ascii'), digest_size=16).digest(), len(encoded))
+    size = _sizes.get(key)
+    if size is None:
+        size = _decode_size(probe, encoded)
+        if len(_sizes) >= SIZE_CACHE_ENTRIES:
+            _sizes.clear()
+        _sizes[key] = size
+    return size
+
+def _decode_size(probe, encoded):
+    for chunk in (probe, encoded):
+        try:
+            with Image.open(io.BytesIO(base64.b64decode(chunk))) as image:
+                return image.size
+        except (OSError, ValueError):
+            continue
+    return MAX_SIDE, MAX_SIDE
+
+def estimate_request_tokens(request):
+    """Return the tokens a request counts against the tokens-per-minute limit.
+
+    That is the prompt (text, images and per-message overhead) plus the
+    completion tokens it may generate, which the API reserves up front.
+    """
+    total = 0
+    for message in request["messages"]:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = message["content"]
+        if isinstance(content, str):
+            total += text_tokens(content)
+            continue
+        for part in content:
+            if part["type"] == "text":
+                total += text_tokens(part["text"])
+            elif part["type"] == "image_url":
+                image_url = part["image_url"]
+                url = image_url["url"]
+                width, height = data_url_size(url) if url.startswith("data:") else (MAX_SIDE, MAX_SIDE)
+                total += image_tokens(width, height, image_url.get("detail", "high"))
+    max_tokens = request.get("max_tokens") or request.get("max_completion_tokens") or 0
+    return total + max_tokens * (request.get("n") or 1)
@@ -0,0 +1,189 @@
+"""
+Constrained Authentic/Spliced verdicts with logprob scores, and a robust parser for free-text answers
+"""
+
+import json
+import math
+import re
+
+LABELS = ('authentic', 'spliced')
+VERDICT_MODES = ('logprobs', 'schema')
+TOP_LOGPROBS = 5
+SAMPLE_TEMPERATURE = 0.7  # default temperature of self-consistency samples
+
+VERDICT_INSTRUCTION = "Reply with exactly one word: Authentic or Spliced."
+VERDICT_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "verdict",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"verdict": {"type": "string", "enum": ["Authentic", "Spliced"]}},
+            "required": ["verdict"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Free-text answers: an explicit "Answer: X" wins, otherwise the label words present in the text
+ANSWER_PATTERN = re.compile(
+    r"\b(?:final\s+)?(?:answer|verdict|decision|conclusion|classification|label)\b\W{0,5}"
+    r"(?:the\s+image\s+is\s+)?(authentic|spliced)\b", re.IGNORECASE)
+LABEL_PATTERN = re.compile(r"\b(not\s+)?(authentic|spliced)\b", re.IGNORECASE)
+
+def parse_decision(text):
+    """Return 'authentic', 'spliced' or None for a raw answer.
+
+    Handles bare labels in any case and punctuation, label fragments cut off by
+    a one-token budget (e.g. 'Spl'), JSON verdicts, "Answer: X" lines and
+    explanations that name a single label (a negated label counts as the other
+    one). Error strings and answers naming both labels without an explicit
+    answer line are None.
+    """
+    if not isinstance(text, str):
+        return None
+    text = text.strip()
+    if not text or text.startswith("ERROR"):
+        return None
+
+    bare = text.strip(" \t\n.!'\"*`").lower()
+    if bare in LABELS:
+        return bare
+    fragment = _token_label(bare)
+    if fragment:
+        return fragment
+
+    if text.startswith("{"):
+        try:
+            verdict = json.loads(text).get("verdict")
+        except (ValueError, AttributeError):
+            verdict = None
+        if isinstance(verdict, str) and verdict.lower() in LABELS:
+            return verdict.lower()
+
+    answers = ANSWER_PATTERN.findall(text)
+    if answers:
+        return answers[-1].lower()
+
+    found = set()
+    for negation, label in LABEL_PATTERN.findall(text):
+        label = label.lower()
+        found.add(LABELS[1 - LABELS.index(label)] if negation else label)
+    return found.pop() if len(found) == 1 else None
+
+def _token_label(token):
+    """Return the label a (possibly partial) answer token starts, e.g. 'Spl' -> 'spliced'."""
+    token = token.strip().strip("\"'").lower()
+    if len(token) < 2:
+        return None
+    for label in LABELS:
+        if label.startswith(token):
+            return label
+    return None
+
+def spliced_probability(logprobs):
+    """Return P(spliced) from the top logprobs of the first answer token, or None without logprobs.
+
+    The probability mass of the alternatives that start each label is summed and
+    renormalised over the two labels.
+    """
+    content = getattr(logprobs, 'content', None) if logprobs is not None else None
+    for position in content or []:
+        if _token_label(position.token) is None:
+            continue  # JSON punctuation and keys before the label
+        mass = dict.fromkeys(LABELS, 0.0)
+        for candidate in position.top_logprobs or [position]:
+            label = _token_label(candidate.token)
+            if label:
+                mass[label] += math.exp(candidate.logprob)
+        total = mass['authentic'] + mass['spliced']
+        return mass['spliced'] / total if total > 0 else None
+    return None
+
+def vote(texts):
+    """Return the (label, spliced share, margin) of a majority vote over sampled answers.
+
+    The share is taken over the answers that parse. The margin is the winning
+    label's lead over the other as a share of all samples, so unparseable samples
+    lower it. A tie goes to the first parsed answer; nothing parsing gives
+    (None, None, 0.0).
+    """
+    votes = [vote for vote in map(parse_decision, texts) if vote]
+    if not votes:
+        return None, None, 0.0
+    spliced = votes.count('spliced')
+    authentic = len(votes) - spliced
+    label = 'spliced' if spliced > authentic else 'authentic' if authentic > spliced else votes[0]
+    return label, spliced / len(votes), abs(spliced - authentic) / len(texts)
+
+def response_samples(response):
+    """Return the stripped answers of a response with several choices (`n` > 1), or None for a single answer."""
+    if len(response.choices) < 2:
+        return None
+    return [(choice.message.content or "").strip() for choice in response.choices]
+
+def vote_columns(samples):
+    """Return the extra results CSV columns of the images decided by a vote: their vote margin."""
+    if not samples:
+        return None
+    return {"LLM-margin": {filename: f"{vote(answers)[2]:.6f}" for filename, answers in samples.items()}}
+
+def extract_decision(response):
+    """Return the (decision, score) of a chat completion.
+
+    Verdict-mode responses carry logprobs: their decision is normalised to
+    'Authentic' or 'Spliced', from the answer token or else the label with the
+    larger logprob mass, and the score is P(spliced). Free-text answers are
+    returned stripped and unscored. A response with several choices (`n` > 1) is
+    decided by majority vote over the parsed choices (see `vote`), scored by the
+    share voting spliced.
+    """
+    choice = response.choices[0]
+    text = (choice.message.content or "").strip()
+    samples = response_samples(response)
+    if samples:
+        label, share, _ = vote(samples)
+        if label:
+            return label.capitalize(), share
+    if choice.logprobs is None:
+        return text, None
+    score = spliced_probability(choice.logprobs)
+    label = parse_decision(text)
+    if label is None and score is not None and score != 0.5:
+        label = 'spliced' if score > 0.5 else 'authentic'  # the answer token itself was no label
+    return (label.capitalize() if label else text), score
+
+def verdict_request(request, mode='logprobs'):
+    """Return a copy of a chat completion request restricted to a single Authentic/Spliced verdict.
+
+    'logprobs' asks for one output token; 'schema' asks for a JSON verdict
+    through structured outputs. Both request the top logprobs for scoring.
+    """
+    messages = [dict(message) for message in request["messages"]]
+    content = messages[-1]["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    messages[-1]["content"] = list(content) + [{"type": "text", "text": VERDICT_INSTRUCTION}]
+
+    request = dict(request, messages=messages, temperature=0, logprobs=True, top_logprobs=TOP_LOGPROBS)
+    if mode == 'schema':
+        request.update(response_format=VERDICT_SCHEMA, max_tokens=16)
+    else:
+        request.update(max_tokens=1)
+    return request
+
+def make_verdict_builder(build_request, mode='logprobs'):
+    """Wrap a strategy's `build_request(image_path, image_url=None)` so it asks for a verdict only."""
+    def build_verdict_request(image_path, image_url=None):
+        return verdict_request(build_request(image_path, image_url), mode)
+    return build_verdict_request
+
+def make_sampling_builder(build_request, samples, temperature=SAMPLE_TEMPERATURE):
+    """Wrap a request builder so one request asks for `samples` answers at `temperature` (self-consistency).
+
+    The prompt and images are sent and paid for once; the answers are decided by `vote`.
+    """
+    def build_sampled_request(image_path, image_url=None):
+        return dict(build_request(image_path, image_url), n=samples, temperature=temperature)
+    return build_sampled_request
@@ -2,40 +2,32 @@
 Evaluation with Zero-Shot Prompt Strategy
 """
 
-import os
-import csv
-import base64
 from dotenv import load_dotenv
 from openai import OpenAI
+from cache import cached_create
+from manifest import iter_image_paths
+from preprocess import image_data_url
+from runner import build_arg_parser, parse_args, run_with_args
+from scheduler import Scheduler
 
 # Load the OpenAI API key
 load_dotenv()
-client = OpenAI()
+# Retries are left to the scheduler, which paces them under the account's rate limits
+client = OpenAI(max_retries=0)
+scheduler = Scheduler()
 
 def get_all_image_paths(folder):
     """Return all image file paths in the folder with valid extensions."""
-    valid_extensions = ('.jpg', '.jpeg', '.png')
-    return [
-        os.path.join(folder, file_name)
-        for file_name in sorted(os.listdir(folder))
-        if file_name.lower().endswith(valid_extensions)
-    ]
-
-def encode_image_to_base64(image_path):
-    """Encode an image file to base64 string."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+    return sorted(iter_image_paths(folder))
 
 def generate_prompt():
     """Return the analysis prompt."""
     return ("Inspect the provided image and identify whether it is original or has been spliced. "
             "Answer with 'Authentic' for an unedited image, or 'Spliced' for a manipulated one.")
 
-def send_image_to_openai(image_path):
-    """Send an image to the OpenAI Vision model and get a response."""
-    base64_image = encode_image_to_base64(image_path)
-
-    response = client.chat.completions.create(
+def build_request(image_path, image_url=None):
+    """Return the chat completion arguments for one image."""
+    return dict(
         model="gpt-4.1-2025-04-14",
         messages=[
             {
@@ -48,7 +40,7 @@ def send_image_to_openai(image_path):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": image_url or image_data_url(image_path)
                         }
                     }
                 ]
@@ -57,30 +49,24 @@ def send_image_to_openai(image_path):
         temperature=0,           # For deterministic, reproducible results
         max_tokens=100
     )
+
+def make_request_builder():
+    """Return the `build_request(image_path, image_url=None)` used by the runners."""
+    return build_request
+
+def send_image_to_openai(image_path, cache=None):
+    """Send an image to the OpenAI Vision model and get a response."""
+    response = cached_create(client, build_request(image_path), cache, scheduler)
     result = response.choices[0].message.content.strip()
     print(result)
     return result
 
 def main():
-    folder = "Sp_sample"
-    output_csv = "Sp_sample_llm_decisions_zero_shot.csv"
-
-    image_paths = get_all_image_paths(folder)
-
-    with open(output_csv, mode='w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["filename", "LLM-decision"])
+    args = parse_args(build_arg_parser(__doc__, "Sp_sample", "Sp_sample_llm_decisions_zero_shot.csv"))
 
-        for path in image_paths:
-            try:
-                print(f"Processing {path}...")
-                decision = send_image_to_openai(path)
-                writer.writerow([os.path.basename(path), decision])
-            except Exception as e:
-                print(f"Error processing {path}: {e}")
-                writer.writerow([os.path.basename(path), f"ERROR: {e}"])
+    image_paths = get_all_image_paths(args.folder)
 
-    print(f"\nProcessing complete. Results saved to: {output_csv}")
+    run_with_args(image_paths, make_request_builder(), args)
 
 if __name__ == "__main__":
     main()